@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import repeat
+from time import perf_counter
+
+from utils.utils import readJson
+from utils.mapper import COMPILERS
+from exo1.exo import bootstrap, create_indexes
+from exo2.exo import refresh
+from exo2.buffer import HistoryBuffer
+from exo2.history import local_day_hour
+from exo3.queries import findClosestStations
+from exo3.spatial import stationIndex
+from storage.mongo import MongoStorage
+from storage.sqlite import SQLiteStorage
+from benchmarks.feeds import SPREAD
+from benchmarks.mongo import localDB
+from benchmarks.standin import FeedServer
+
+
+NB_STATIONS = 1000 # per city
+NB_CITIES = 6 # dialects taken in turn : Lille, Lyon, Montpellier
+NB_TICKS = 10 # timed refreshes of every city
+NB_QUERIES = 200 # per query kind
+RESULTS = "benchmarks/results"
+COLLECTIONS = ["live", "history", "history_rollups"]
+
+
+def city_api(path, section, url, city):
+    # the api of a real town, pointed at the stand-in and renamed after the city
+    api = readJson(path)[section]
+    api["url"] = url
+    api["fields_mapper"]["ville"] = city
+    api["transform"] = COMPILERS[section](api["fields_mapper"])
+    return api
+
+
+def percentiles(durations):
+    durations = sorted(durations)
+    return {
+        "p50_ms": round(durations[len(durations) // 2] * 1000, 3),
+        "p99_ms": round(durations[int(len(durations) * 0.99)] * 1000, 3)
+    }
+
+
+def timed(function, calls):
+    durations = []
+    for args in calls:
+        begin = perf_counter()
+        result = function(*args)
+        if result is not None and not isinstance(result, list):
+            list(result) # cursors run when iterated
+        durations.append(perf_counter() - begin)
+    return percentiles(durations)
+
+
+def run_bootstrap(storage, statics):
+    begin = perf_counter()
+    with ThreadPoolExecutor(max_workers=len(statics)) as pool:
+        timings = list(pool.map(lambda api: bootstrap(api, storage), statics))
+    inserted = perf_counter() - begin
+
+    begin = perf_counter()
+    create_indexes(storage)
+    return {
+        "stations": sum(timing["inserted"] for timing in timings),
+        "insert_s": round(inserted, 3),
+        "indexes_s": round(perf_counter() - begin, 3),
+        "stations_per_s": round(sum(timing["inserted"] for timing in timings) / inserted)
+    }
+
+
+def start_buffer(storage):
+    history, evt_end = HistoryBuffer(storage), threading.Event()
+    thread = threading.Thread(target=history.run, args=(evt_end,))
+    thread.start()
+    return history, evt_end, thread
+
+
+def run_refresh(storage, dynamics, ticks):
+    last_seen = {api["fields_mapper"]["ville"]: {} for api in dynamics}
+    tick = lambda api, history: refresh(api, storage, history, last_seen[api["fields_mapper"]["ville"]])
+
+    with ThreadPoolExecutor(max_workers=len(dynamics)) as pool:
+        # warm up : every station is new to last_seen, its samples are drained before the timed ticks
+        warmup, evt_end, thread = start_buffer(storage)
+        list(pool.map(tick, dynamics, repeat(warmup)))
+        evt_end.set()
+        thread.join()
+
+        history, evt_end, thread = start_buffer(storage)
+        begin = perf_counter()
+        durations, counters = [], []
+        for _ in range(ticks):
+            start = perf_counter()
+            counters += pool.map(tick, dynamics, repeat(history))
+            durations.append(perf_counter() - start)
+        elapsed = perf_counter() - begin
+
+    evt_end.set()
+    thread.join() # drains the buffer
+    drained = perf_counter() - begin
+
+    stations = sum(counter["changed"] + counter["unchanged"] for counter in counters)
+    changed = sum(counter["changed"] for counter in counters)
+    return {
+        "refresh": {
+            "ticks": ticks,
+            "stations_per_s": round(stations / elapsed),
+            "changed_per_s": round(changed / elapsed),
+            "tick": percentiles(durations)
+        },
+        "history": {
+            "samples": history.written,
+            "samples_per_s": round(history.written / drained),
+            **history.metrics()
+        }
+    }
+
+
+def run_queries(storage, server, nb):
+    rand = random.Random(1)
+    cities = list(server.cities.values())
+
+    def point():
+        lat, lon = rand.choice(cities)[1]
+        return [lon + rand.uniform(-SPREAD, SPREAD), lat + rand.uniform(-SPREAD, SPREAD)]
+
+    def triangle():
+        lon, lat = point()
+        r = SPREAD / 5
+        return [[lon - r, lat - r], [lon + r, lat - r], [lon, lat + r]]
+
+    points = [(point(), 0, 400, 3) for _ in range(nb)]
+    stationIndex.load(storage)
+    _, hour = local_day_hour(datetime.utcnow()) # the samples of the run are all in the current hour of the rollups
+
+    return {
+        "closest": timed(storage.closest, points), # $geoNear on mongo
+        "closest_index": timed(findClosestStations, [(storage, *args) for args in points]),
+        "search": timed(storage.search, [(rand.choice(list(server.cities)), f"station {rand.randint(1, 99)}") for _ in range(nb)]),
+        "polygon": timed(storage.within, [(triangle(),) for _ in range(nb)]),
+        "stats": timed(storage.stats, [("$lt", ratio, max(hour - 1, 0), hour, 1, 7) for ratio in range(5, 100, 5)])
+    }
+
+
+def compare(results, previous):
+    print(f"\ncompared with {previous['date']} :")
+    for phase, metrics in results.items():
+        if not isinstance(metrics, dict) or not isinstance(previous.get(phase), dict):
+            continue
+        for name, value in metrics.items():
+            before = previous[phase].get(name)
+            if isinstance(value, dict) and isinstance(before, dict):
+                pairs = [(f"{name}.{key}", value[key], before.get(key)) for key in value]
+            else:
+                pairs = [(name, value, before)]
+            for label, now, then in pairs:
+                if isinstance(now, (int, float)) and isinstance(then, (int, float)) and then:
+                    print(f"  {phase:<9} {label:<26} {then:>12} => {now:>12}   x{now / then:.2f}")
+
+
+def connect(backend):
+    if backend == "sqlite":
+        return SQLiteStorage(), None
+
+    db = localDB()
+    if db is None:
+        return None, None
+
+    for collection in COLLECTIONS:
+        db[collection].drop()
+    return MongoStorage(db), db
+
+
+def main(backend, nb, nb_cities, ticks, nb_queries, quiet, previous=None):
+    storage, db = connect(backend)
+    if storage is None:
+        return
+
+    server = FeedServer(nb_cities, nb).start()
+    print(f"{nb_cities} cities of {nb} stations, {ticks} ticks, {nb_queries} queries per kind, stand-in at {server.url}")
+    server.prepare(ticks + 1)
+
+    statics, dynamics = [], []
+    for city, (town, _) in server.cities.items():
+        path = f"apis/{town.lower()}.json"
+        statics.append(city_api(path, "static", f"{server.url}/{city}/static", city))
+        dynamics.append(city_api(path, "dynamic", f"{server.url}/{city}/dynamic", city))
+
+    results = {"date": datetime.now().isoformat(timespec="seconds"),
+                "config": {"storage": backend, "stations": nb, "cities": nb_cities, "ticks": ticks, "queries": nb_queries}}
+    try:
+        output = io.StringIO() if quiet else sys.stdout # the exercises print every tick of every city
+        with contextlib.redirect_stdout(output):
+            results["bootstrap"] = run_bootstrap(storage, statics)
+            results.update(run_refresh(storage, dynamics, ticks))
+        results["queries"] = run_queries(storage, server, nb_queries)
+
+    finally:
+        server.stop()
+        storage.close()
+        if db is not None:
+            for collection in COLLECTIONS:
+                db[collection].drop()
+
+    print(json.dumps(results, indent=4))
+
+    os.makedirs(RESULTS, exist_ok=True)
+    path = f"{RESULTS}/e2e-{backend}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(path, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"results saved in {path}")
+
+    if previous:
+        compare(results, readJson(previous))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="bootstrap, refresh ticks and queries over synthetic feeds " +
+                                                "against a local mongod (BENCH_MONGO_URI) or an in-memory sqlite")
+    parser.add_argument("--storage", choices=["mongo", "sqlite"], default="mongo")
+    parser.add_argument("--stations", type=int, default=NB_STATIONS, help="per city")
+    parser.add_argument("--cities", type=int, default=NB_CITIES)
+    parser.add_argument("--ticks", type=int, default=NB_TICKS)
+    parser.add_argument("--queries", type=int, default=NB_QUERIES)
+    parser.add_argument("--verbose", action="store_true", help="keep the output of the exercises")
+    parser.add_argument("--compare", help="results file of a previous run")
+    args = parser.parse_args()
+
+    main(args.storage, args.stations, args.cities, args.ticks, args.queries, not args.verbose, args.compare)
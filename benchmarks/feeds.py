@@ -0,0 +1,141 @@
+import random
+from time import time
+
+
+TOWNS = {
+    "Lille": (50.6342, 3.0485),
+    "Lyon": (45.7640, 4.8357),
+    "Montpellier": (43.6108, 3.8767)
+}
+SPREAD = 0.05 # degrees around the town center
+CHANGED = 0.3 # part of the stations whose counts change at each tick
+SNAPSHOT = int(time()) - 3600 # gbfs last_updated of tick 0, in the past so a zero ttl is expired
+
+
+def stations(nb, center, seed=0, tick=0):
+    # tick : later snapshot of the same stations, CHANGED of them got new counts
+    rand = random.Random(seed)
+    ticker = random.Random(f"{seed}-{tick}")
+    for i in range(nb):
+        capacity = rand.randint(10, 40)
+        bikes = rand.randint(0, capacity)
+        if tick and ticker.random() < CHANGED:
+            bikes = ticker.randint(0, capacity)
+        yield {
+            "id": str(i + 1),
+            "name": f"{i + 1:05} Station {i + 1}",
+            "lat": round(center[0] + rand.uniform(-SPREAD, SPREAD), 6),
+            "lon": round(center[1] + rand.uniform(-SPREAD, SPREAD), 6),
+            "capacity": capacity,
+            "bikes": bikes,
+            "docks": capacity - bikes
+        }
+
+
+def gbfs_information(nb, center, seed=0, tick=0):
+    return {
+        "last_updated": SNAPSHOT + tick, # a new snapshot at each tick
+        "ttl": 0,
+        "data": {
+            "stations": [{
+                "station_id": station["id"],
+                "name": station["name"],
+                "lat": station["lat"],
+                "lon": station["lon"],
+                "capacity": station["capacity"]
+            } for station in stations(nb, center, seed, tick)]
+        }
+    }
+
+
+def gbfs_status(nb, center, seed=0, tick=0):
+    return {
+        "last_updated": SNAPSHOT + tick, # a new snapshot at each tick
+        "ttl": 0,
+        "data": {
+            "stations": [{
+                "station_id": station["id"],
+                "is_installed": 1,
+                "is_renting": 1,
+                "is_returning": 1,
+                "last_reported": int(time()),
+                "num_bikes_available": station["bikes"],
+                "num_docks_available": station["docks"]
+            } for station in stations(nb, center, seed, tick)]
+        }
+    }
+
+
+def opendatasoft_records(nb, center, seed=0, tick=0):
+    return {
+        "nhits": nb,
+        "records": [{
+            "datasetid": "synthetic",
+            "recordid": station["id"],
+            "fields": {
+                "id": station["id"],
+                "na": station["name"],
+                "la": station["lat"],
+                "lg": station["lon"],
+                "to": station["capacity"],
+                "av": station["bikes"],
+                "fr": station["docks"]
+            }
+        } for station in stations(nb, center, seed, tick)]
+    }
+
+
+def lille_records(nb, center, seed=0, tick=0):
+    return {
+        "nhits": nb,
+        "records": [{
+            "datasetid": "vlille-realtime",
+            "recordid": station["id"],
+            "fields": {
+                "libelle": int(station["id"]),
+                "nom": station["name"].upper(),
+                "etat": "EN SERVICE",
+                "type": "AVEC TPE",
+                "nbvelosdispo": station["bikes"],
+                "nbplacesdispo": station["docks"],
+                "geo": [station["lat"], station["lon"]],
+                "localisation": [station["lat"], station["lon"]]
+            },
+            "geometry": {
+                "type": "Point",
+                "coordinates": [station["lon"], station["lat"]]
+            }
+        } for station in stations(nb, center, seed, tick)]
+    }
+
+
+# town => (static payload, dynamic payload), each in the dialect of its apis/*.json mapper
+DIALECTS = {
+    "Lille": (lille_records, lille_records),
+    "Lyon": (gbfs_information, gbfs_status),
+    "Montpellier": (opendatasoft_records, opendatasoft_records)
+}
+
+
+def feed(town, kind, nb, seed=0, tick=0, center=None):
+    # town : one of TOWNS, its dialect is used ; center : elsewhere than the town
+    generator = DIALECTS[town][0 if kind == "static" else 1]
+    return generator(nb, center or TOWNS[town], seed, tick)
+
+
+def live_stations(town, nb, seed=0):
+    # live documents as exo1 + one refresh would store them
+    from utils.utils import readJson, access_data
+    from utils.mapper import compile_static
+
+    api = readJson(f"apis/{town.lower()}.json")["static"]
+    transform = compile_static(api["fields_mapper"])
+    counts = stations(nb, TOWNS[town], seed)
+
+    documents = []
+    for fields, station in zip(access_data(feed(town, "static", nb, seed), api["data_access"]), counts):
+        document = transform(fields)
+        document["nbvelosdispo"], document["nbplacesdispo"] = station["bikes"], station["docks"]
+        documents.append(document)
+
+    return documents
@@ -0,0 +1,85 @@
+import sys
+from timeit import repeat
+
+from utils.utils import listFiles, readJson, access_data, nameFields
+from utils.mapper import COMPILERS
+from benchmarks.feeds import feed
+
+
+NB_RECORDS = 10000
+REPEAT = 5
+
+
+# per record mapping as done before the mappers were compiled
+def interpreter(field, fields, mapper):
+    atomic_mapper = mapper[field]
+
+    if not type(atomic_mapper) == dict:
+        return fields[atomic_mapper]
+
+    elif "addition" in atomic_mapper:
+        atomic_mapper = atomic_mapper["addition"]
+        return fields[atomic_mapper[0]] + fields[atomic_mapper[1]]
+
+    elif "var" in atomic_mapper and "pos" in atomic_mapper:
+        return fields[atomic_mapper["var"]][atomic_mapper["pos"]]
+
+
+def interpreted_static(fields, mapper):
+    return {
+        "_id": f"{mapper['ville']}_{fields[mapper['_id']]}",
+        "ville": mapper['ville'],
+        "nom": fields[mapper['nom']].title(),
+        **nameFields(fields[mapper['nom']].title()),
+        "nbvelosdispo": 0,
+        "nbplacesdispo": 0,
+        "nbplacestotal": interpreter("nbplacestotal", fields, mapper),
+        "actif": True,
+        "version": 0,
+        "geometry": {
+            "type": "Point",
+            "coordinates": [
+                interpreter("longitude", fields, mapper),
+                interpreter("latitude", fields, mapper)
+        ]}
+    }
+
+
+def interpreted_dynamic(fields, mapper):
+    return {
+        "_id": f"{mapper['ville']}_{fields[mapper['_id']]}",
+        "nbvelosdispo": fields[mapper['nbvelosdispo']],
+        "nbplacesdispo": fields[mapper['nbplacesdispo']]
+    }
+
+
+INTERPRETERS = {
+    "static": interpreted_static,
+    "dynamic": interpreted_dynamic
+}
+
+
+def per_record(function, records):
+    best = min(repeat(function, number=1, repeat=REPEAT))
+    return best / len(records) * 1e9 # ns
+
+
+def main(nb):
+    print(f"{'town':<12} {'section':<8} {'before (ns)':>11} {'after (ns)':>10} {'speedup':>7}")
+    for path in sorted(listFiles("apis")):
+        for section in ["static", "dynamic"]:
+            api = readJson(path)[section]
+            mapper = api["fields_mapper"]
+            town = mapper["ville"]
+            records = access_data(feed(town, section, nb), api["data_access"])
+
+            interpreted, compiled = INTERPRETERS[section], COMPILERS[section](mapper)
+            assert [interpreted(fields, mapper) for fields in records] == list(map(compiled, records))
+
+            before = per_record(lambda: [interpreted(fields, mapper) for fields in records], records)
+            after = per_record(lambda: list(map(compiled, records)), records)
+            print(f"{town:<12} {section:<8} {before:>11.0f} {after:>10.0f} {before / after:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_RECORDS)
@@ -0,0 +1,17 @@
+import os
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+
+MONGO_URI = os.environ.get("BENCH_MONGO_URI", "mongodb://localhost:27017")
+
+
+def localDB(name="bench"):
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        print(f"no mongod reachable at {MONGO_URI} (set BENCH_MONGO_URI), database paths skipped")
+        return None
+
+    return client[name]
@@ -0,0 +1,84 @@
+import random
+import sys
+from time import perf_counter
+
+from exo3.queries import geoNearStations
+from exo3.spatial import StationIndex
+from benchmarks.feeds import live_stations, TOWNS, SPREAD
+from benchmarks.mongo import localDB
+
+
+NB_STATIONS = 10000
+NB_QUERIES = 1000
+BATCH_SIZES = [1000, 10000, 100000] # query points per closestBatch call
+QUERY = (0, 400, 3) # minDistance, maxDistance, closest
+
+
+class Documents:
+    # the part of a storage StationIndex.load uses
+    def __init__(self, documents):
+        self.documents = documents
+
+    def stations(self):
+        return self.documents
+
+
+def points(nb, seed=1):
+    rand = random.Random(seed)
+    lat, lon = TOWNS["Lyon"]
+    return [[lon + rand.uniform(-SPREAD, SPREAD), lat + rand.uniform(-SPREAD, SPREAD)] for _ in range(nb)]
+
+
+def timings(function, queries):
+    durations = []
+    for coordinates in queries:
+        begin = perf_counter()
+        function(coordinates)
+        durations.append(perf_counter() - begin)
+
+    durations.sort()
+    return durations[len(durations) // 2] * 1e6, durations[int(len(durations) * 0.99)] * 1e6
+
+
+def report(name, p50, p99):
+    print(f"{name:<10} p50 {p50:>10.1f} µs   p99 {p99:>10.1f} µs")
+
+
+def batch(index, geoNear_p50):
+    for size in BATCH_SIZES:
+        queries = points(size, seed=size)
+        begin = perf_counter()
+        index.closestBatch(queries, *QUERY)
+        duration = perf_counter() - begin
+
+        line = f"batch {size:>7} points {duration:>8.3f} s   {duration / size * 1e6:>7.1f} µs/point"
+        if geoNear_p50:
+            line += f"   x{geoNear_p50 * size / 1e6 / duration:>7.0f} vs {size} $geoNear calls"
+        print(line)
+
+
+def main(nb):
+    documents = live_stations("Lyon", nb)
+    queries = points(NB_QUERIES)
+    print(f"{nb} stations, {len(queries)} queries, min/max/closest {QUERY}")
+
+    index = StationIndex()
+    index.load(Documents(documents))
+    report("index", *timings(lambda coordinates: index.closest(coordinates, *QUERY), queries))
+
+    geoNear_p50 = None
+    db = localDB()
+    if db is not None:
+        collection = db.nearest
+        collection.drop()
+        collection.insert_many(documents)
+        collection.create_index([("geometry", "2dsphere")])
+        geoNear_p50, geoNear_p99 = timings(lambda coordinates: geoNearStations(collection, coordinates, *QUERY), queries)
+        report("$geoNear", geoNear_p50, geoNear_p99)
+        collection.drop()
+
+    batch(index, geoNear_p50)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_STATIONS)
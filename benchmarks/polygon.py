@@ -0,0 +1,63 @@
+import sys
+from time import perf_counter
+
+from exo4.exo4_4.exo import polygonFilter, pointsInPolygon
+from exo4.mapstate import TownStations
+from benchmarks.feeds import live_stations, TOWNS, SPREAD
+from benchmarks.mongo import localDB
+
+
+SIZES = [10000, 100000]
+REPEAT = 5
+
+
+def polygon(town):
+    # a star over half the town with a square hole in the middle, [lon, lat] points
+    lat, lon = TOWNS[town]
+    r = SPREAD / 2
+    outer = [[lon - r, lat - r], [lon, lat - r / 3], [lon + r, lat - r], [lon + r / 3, lat],
+             [lon + r, lat + r], [lon, lat + r / 3], [lon - r, lat + r], [lon - r / 3, lat]]
+    hole = [[lon - r / 8, lat - r / 8], [lon + r / 8, lat - r / 8], [lon + r / 8, lat + r / 8], [lon - r / 8, lat + r / 8]]
+    return [outer, hole]
+
+
+def best(function):
+    durations = []
+    for _ in range(REPEAT):
+        begin = perf_counter()
+        result = function()
+        durations.append(perf_counter() - begin)
+    return min(durations) * 1000, result
+
+
+def main(sizes):
+    db = localDB()
+    town = "Lyon"
+    shape = polygon(town)
+
+    for nb in sizes:
+        documents = live_stations(town, nb)
+        lon, lat = zip(*[document["geometry"]["coordinates"] for document in documents])
+        stations = TownStations([document["_id"] for document in documents], lon, lat, [True] * nb)
+
+        duration, mask = best(lambda: pointsInPolygon(stations.lon, stations.lat, shape))
+        print(f"{nb:>7} stations   in memory     {duration:>8.2f} ms   {mask.sum()} selected")
+        duration, _ = best(lambda: stations.within(shape))
+        print(f"{nb:>7} stations   ids selected  {duration:>8.2f} ms")
+
+        if db is not None:
+            collection = db.polygon
+            collection.drop()
+            collection.insert_many(documents)
+            collection.create_index([("geometry", "2dsphere")])
+
+            duration, count = best(lambda: len(list(collection.find(polygonFilter(shape), {"_id": 1}))))
+            print(f"{nb:>7} stations   $geometry     {duration:>8.2f} ms   {count} selected")
+            legacy = {"geometry": {"$geoWithin": {"$polygon": shape[0]}}} # no hole, no index
+            duration, count = best(lambda: len(list(collection.find(legacy, {"_id": 1}))))
+            print(f"{nb:>7} stations   $polygon      {duration:>8.2f} ms   {count} selected (outer ring only)")
+            collection.drop()
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,128 @@
+import io
+import pickle
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import matplotlib
+matplotlib.use("agg")
+import matplotlib.pyplot as plt
+from matplotlib.patches import Polygon
+from matplotlib.colors import ListedColormap
+from PIL import Image
+
+from utils.utils import readJson
+from exo4.render import MapRenderer, DISPLAY_HEIGHT
+from benchmarks.feeds import live_stations, TOWNS
+
+
+NB_STATIONS = 1000 # per town
+REPEAT = 10
+
+
+# map refresh as done before the render layer : pickled figure copy, png written then read back
+def dumpGraph(graph):
+    graph_buffer = io.BytesIO()
+    pickle.dump(graph, graph_buffer)
+    graph_buffer.seek(0)
+    return pickle.load(graph_buffer)
+
+
+def before(town, x, y, actif, polygon, tmpDir):
+    mapBox = readJson(f"apis/{town.lower()}.json")["visual"]["boundingBox"]
+    fig = plt.figure()
+    ax = fig.gca()
+    ax.grid(True)
+    ax.imshow(plt.imread(f"apis/imgs/{town}.png"), extent=mapBox, zorder=0, aspect='equal')
+    ax.set_xlim(mapBox[0], mapBox[1])
+    ax.set_ylim(mapBox[2], mapBox[3])
+
+    def refresh():
+        newfig = dumpGraph(fig)
+        newfig.gca().scatter(x, y, zorder=3, s=10, c=actif, cmap=ListedColormap(["r", "darkolivegreen"]))
+        newfig.savefig(f"{tmpDir}/{town}.png")
+        picture(f"{tmpDir}/{town}.png")
+        return newfig
+
+    def draw(graph):
+        newfig = dumpGraph(graph)
+        ax = newfig.gca()
+        ax.add_patch(Polygon(polygon, zorder=1, alpha=0.2, color="cornflowerblue"))
+        ax.add_patch(Polygon(polygon, zorder=2, linestyle='solid', fill=False, color="blue"))
+        ax.scatter([x for x, _ in polygon], [y for _, y in polygon], c="blue", marker="x")
+        newfig.savefig(f"{tmpDir}/{town}.png")
+        picture(f"{tmpDir}/{town}.png")
+        plt.close(newfig)
+
+    return refresh, draw
+
+
+def after(town, x, y, actif, polygon):
+    mapBox = readJson(f"apis/{town.lower()}.json")["visual"]["boundingBox"]
+    renderer = MapRenderer(plt.imread(f"apis/imgs/{town}.png"), mapBox)
+
+    def refresh():
+        renderer.set_stations(x, y, actif)
+        picture(renderer.render())
+        return renderer
+
+    def draw(_):
+        renderer.set_polygon(polygon)
+        picture(renderer.render())
+        renderer.set_polygon(None)
+
+    return refresh, draw
+
+
+def picture(image):
+    # what guizero.Picture does with its source before handing it to Tk
+    image = Image.open(image) if type(image) == str else image
+    width = round(image.width * DISPLAY_HEIGHT / image.height)
+    return image.resize((width, DISPLAY_HEIGHT))
+
+
+def redraw(refresh, draw):
+    begin = perf_counter()
+    graph = refresh()
+    middle = perf_counter()
+    draw(graph)
+    end = perf_counter()
+
+    if graph.__class__.__name__ == "Figure":
+        plt.close(graph)
+    return middle - begin, end - middle
+
+
+def measure(refresh, draw):
+    durations = list(zip(*[redraw(refresh, draw) for _ in range(REPEAT)]))
+    median = [sorted(values)[len(values) // 2] for values in durations]
+
+    tracemalloc.start() # separate pass, tracing slows every allocation down
+    redraw(refresh, draw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"refresh": median[0] * 1000, "polygon": median[1] * 1000}, peak / 2**20
+
+
+def main(nb):
+    print(f"{nb} stations per town, median of {REPEAT} redraws, peak = python allocations during one redraw")
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for town in TOWNS:
+            stations = live_stations(town, nb)
+            x = [station["geometry"]["coordinates"][1] for station in stations] # maps show latitude on x
+            y = [station["geometry"]["coordinates"][0] for station in stations]
+            actif = [i % 10 != 0 for i in range(len(stations))]
+            polygon = [[min(x), min(y)], [min(x), max(y)], [max(x), max(y)]]
+
+            for name, (refresh, draw) in [("before", before(town, x, y, actif, polygon, tmpDir)),
+                                            ("after", after(town, x, y, actif, polygon))]:
+                times, peak = measure(refresh, draw)
+                print(f"{town:<12} {name:<7} refresh {times['refresh']:>7.1f} ms   polygon {times['polygon']:>7.1f} ms   peak {peak:>7.1f} MiB")
+
+            plt.close("all")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_STATIONS)
@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import random
+from time import perf_counter
+
+from aiohttp import web, ClientSession, TCPConnector
+
+from service.server import QueryService
+from storage.mongo import MongoStorage
+from benchmarks.feeds import live_stations, TOWNS, SPREAD
+from benchmarks.mongo import localDB
+
+
+NB_STATIONS = 2000 # per town
+CONCURRENCY = 64 # clients running at the same time
+DURATION = 10 # seconds per scenario
+
+
+def seed(db, nb):
+    db.live.drop()
+    db.history_rollups.drop()
+    rand = random.Random(0)
+
+    for town in TOWNS:
+        documents = live_stations(town, nb)
+        db.live.insert_many(documents)
+        db.history_rollups.insert_many([{
+            "_id": f"{document['_id']}_{day}_{hour}",
+            "station_id": document["_id"],
+            "dayOfWeek": day,
+            "hourOfDay": hour,
+            "sum_velos": rand.randint(0, 400),
+            "sum_places": rand.randint(0, 400),
+            "nbsamples": 20
+        } for document in documents for day in range(1, 8) for hour in range(6, 22, 4)])
+
+    db.live.create_index([("geometry", "2dsphere")])
+    db.live.create_index([("ville", 1), ("nom_normalise", 1), ("_id", 1)])
+    db.live.create_index([("nom_normalise", 1), ("_id", 1)])
+    db.live.create_index([("nom_ngrams", 1)])
+    db.history_rollups.create_index([("dayOfWeek", 1), ("hourOfDay", 1)])
+
+
+def scenarios(rand):
+    def point():
+        lat, lon = TOWNS[rand.choice(list(TOWNS))]
+        return lon + rand.uniform(-SPREAD, SPREAD), lat + rand.uniform(-SPREAD, SPREAD)
+
+    def closest():
+        lon, lat = point()
+        return "GET", f"/stations/closest?lon={lon}&lat={lat}&max=500&limit=5", None
+
+    def search():
+        return "GET", f"/stations/search?town={rand.choice(list(TOWNS))}&name=station {rand.randint(1, 99)}&limit=20", None
+
+    def polygon():
+        lon, lat = point()
+        r = SPREAD / 5
+        return "POST", "/stations/polygon?limit=200", {"polygon": [[lon - r, lat - r], [lon + r, lat - r], [lon, lat + r]]}
+
+    def stats():
+        hour = rand.randint(6, 20)
+        return "GET", f"/stations/stats?compare=lt&ratio=30&begin_hour={hour}&end_hour={hour + 1}&begin_week=2&end_week=6&limit=50", None
+
+    return {"closest": closest, "search": search, "polygon": polygon, "stats": stats}
+
+
+async def client(session, base, scenario, deadline, latencies, failures):
+    while perf_counter() < deadline:
+        method, path, body = scenario()
+        begin = perf_counter()
+        async with session.request(method, base + path, json=body, headers={"Accept-Encoding": "gzip"}) as response:
+            await response.read()
+            if response.status != 200:
+                failures.append(response.status)
+        latencies.append(perf_counter() - begin)
+
+
+async def load(base, name, scenario, concurrency, duration):
+    latencies, failures = [], []
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        begin = perf_counter()
+        await asyncio.gather(*[client(session, base, scenario, begin + duration, latencies, failures)
+                                for _ in range(concurrency)])
+        elapsed = perf_counter() - begin
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:<8} {len(latencies) / elapsed:>8.0f} req/s   p50 {p50:>7.1f} ms   p99 {p99:>7.1f} ms   " +
+        f"{len(failures)} failures")
+
+
+async def main(nb, concurrency, duration):
+    db = localDB()
+    if db is None:
+        return
+
+    print(f"seeding {nb} stations per town...")
+    seed(db, nb)
+
+    runner = web.AppRunner(QueryService(MongoStorage(db)).application())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    print(f"{concurrency} clients, {duration}s per scenario")
+    try:
+        for name, scenario in scenarios(random.Random(1)).items():
+            await load(base, name, scenario, concurrency, duration)
+    finally:
+        await runner.cleanup()
+        db.live.drop()
+        db.history_rollups.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load test of the json service against a local mongod (BENCH_MONGO_URI)")
+    parser.add_argument("--stations", type=int, default=NB_STATIONS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DURATION)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.stations, args.concurrency, args.duration))
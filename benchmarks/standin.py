@@ -0,0 +1,91 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import threading
+
+from benchmarks.feeds import feed, TOWNS
+
+
+CITY_SPACING = 0.2 # degrees of latitude between two synthetic cities
+
+
+class FeedServer:
+    # local stand-in for the city apis : /<city>/static and /<city>/dynamic, in the dialect of a real town
+    # every request of a dynamic feed serves the next tick of that city
+
+    def __init__(self, nb_cities, nb_stations, host="127.0.0.1", port=0):
+        towns = list(TOWNS)
+        self.cities = {} # name => (dialect town, center)
+        for i in range(nb_cities):
+            town = towns[i % len(towns)]
+            lat, lon = TOWNS[town]
+            self.cities[f"{town}{i}"] = (town, (lat + (i // len(towns)) * CITY_SPACING, lon))
+
+        self.nb_stations = nb_stations
+        self.payloads = {} # (city, kind, tick) => json bytes
+        self.ticks = {city: 0 for city in self.cities}
+        self.lock = threading.Lock()
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *_):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+
+    def payload(self, city, kind, tick):
+        key = (city, kind, tick)
+        if key not in self.payloads:
+            town, center = self.cities[city]
+            seed = list(self.cities).index(city)
+            self.payloads[key] = json.dumps(feed(town, kind, self.nb_stations, seed, tick, center)).encode()
+        return self.payloads[key]
+
+
+    def prepare(self, ticks):
+        # generated ahead, so serving a feed costs no more than a real server would
+        for city in self.cities:
+            self.payload(city, "static", 0)
+            for tick in range(1, ticks + 1):
+                self.payload(city, "dynamic", tick)
+
+
+    def handle(self, request):
+        parts = request.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] not in self.cities or parts[1] not in ["static", "dynamic"]:
+            request.send_error(404)
+            return
+
+        city, kind = parts
+        tick = 0
+        if kind == "dynamic":
+            with self.lock:
+                self.ticks[city] += 1
+                tick = self.ticks[city]
+
+        body = self.payload(city, kind, tick)
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+    def start(self):
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
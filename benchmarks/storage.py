@@ -0,0 +1,101 @@
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from storage.mongo import MongoStorage
+from storage.sqlite import SQLiteStorage
+from benchmarks.feeds import live_stations, TOWNS, SPREAD
+from benchmarks.mongo import localDB
+
+
+NB_STATIONS = 2000 # per town
+NB_TICKS = 20 # refreshes, each changing a third of the stations
+NB_QUERIES = 200 # per query kind
+
+
+def workload(nb, seed=0):
+    rand = random.Random(seed)
+    stations = [station for town in TOWNS for station in live_stations(town, nb)]
+
+    ticks = []
+    now = datetime.utcnow().replace(microsecond=0)
+    for tick in range(NB_TICKS):
+        timestamp = now + timedelta(hours=tick * 8) # spread over the week for the stats
+        changed = [{"_id": station["_id"], "nbvelosdispo": rand.randint(0, 20), "nbplacesdispo": rand.randint(0, 20)}
+                    for station in rand.sample(stations, len(stations) // 3)]
+        ticks.append((changed, [(data["_id"], {**data, "record_timestamp": timestamp}) for data in changed]))
+
+    def point():
+        lat, lon = TOWNS[rand.choice(list(TOWNS))]
+        return [lon + rand.uniform(-SPREAD, SPREAD), lat + rand.uniform(-SPREAD, SPREAD)]
+
+    def triangle():
+        lon, lat = point()
+        r = SPREAD / 5
+        return [[lon - r, lat - r], [lon + r, lat - r], [lon, lat + r]]
+
+    queries = {
+        "closest": [(point(), 0, 400, 3) for _ in range(NB_QUERIES)],
+        "within": [(triangle(),) for _ in range(NB_QUERIES)],
+        "search": [(rand.choice(list(TOWNS)), f"station {rand.randint(1, 99)}") for _ in range(NB_QUERIES)],
+        "stats": [("$lt", 30, hour, hour + 1, 2, 6) for hour in range(0, 22, 2)]
+    }
+    return stations, ticks, queries
+
+
+def timed(function, calls):
+    durations = []
+    for args in calls:
+        begin = perf_counter()
+        function(*args)
+        durations.append(perf_counter() - begin)
+    return durations
+
+
+def report(name, operation, durations, unit=None):
+    durations = sorted(durations)
+    line = f"{name:<7} {operation:<9} p50 {durations[len(durations) // 2] * 1000:>8.2f} ms   " + \
+        f"p99 {durations[int(len(durations) * 0.99)] * 1000:>8.2f} ms"
+    if unit:
+        line += f"   {unit[1] / sum(durations):>9.0f} {unit[0]}/s"
+    print(line)
+
+
+def run(name, storage, stations, ticks, queries):
+    begin = perf_counter()
+    storage.insert_stations([dict(station) for station in stations]) # mongo adds the _id to an inserted dict
+    print(f"{name:<7} insert    {perf_counter() - begin:>8.2f} s for {len(stations)} stations")
+
+    report(name, "counts", timed(storage.update_counts, [(changed,) for changed, _ in ticks]),
+            ("stations", sum(len(changed) for changed, _ in ticks)))
+    report(name, "history", timed(storage.append_history, [(samples,) for _, samples in ticks]),
+            ("samples", sum(len(samples) for _, samples in ticks)))
+
+    for operation, calls in queries.items():
+        report(name, operation, timed(getattr(storage, operation), calls))
+
+
+def main(nb):
+    stations, ticks, queries = workload(nb)
+    print(f"{len(stations)} stations, {len(ticks)} ticks of {len(ticks[0][0])} changes, {NB_QUERIES} queries per kind")
+
+    storage = SQLiteStorage()
+    run("sqlite", storage, stations, ticks, queries)
+    storage.close()
+
+    db = localDB()
+    if db is not None:
+        for collection in ["live", "history", "history_rollups"]:
+            db[collection].drop()
+
+        storage = MongoStorage(db)
+        storage.create_indexes()
+        run("mongo", storage, stations, ticks, queries)
+
+        for collection in ["live", "history", "history_rollups"]:
+            db[collection].drop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_STATIONS)
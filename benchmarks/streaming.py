@@ -0,0 +1,64 @@
+import json
+import sys
+import tracemalloc
+from time import perf_counter
+
+from utils.utils import access_data, stream_data, parse_feed, CHUNK_SIZE
+from benchmarks.feeds import feed
+
+
+SIZES = [1000, 10000, 50000] # stations per feed
+REPEAT = 3 # timed runs, the best one is kept
+ACCESS = {
+    "Lyon": ["data", "stations"],
+    "Montpellier": ["records", {"unpack": "fields"}]
+}
+
+
+def chunked(blob):
+    for i in range(0, len(blob), CHUNK_SIZE):
+        yield blob[i:i+CHUNK_SIZE]
+
+
+def current_path(blob, actions):
+    return sum(1 for _ in access_data(json.loads(blob), actions))
+
+
+def streaming_path(blob, actions):
+    return sum(1 for _ in stream_data(chunked(blob), actions))
+
+
+def adaptive_path(blob, actions):
+    # what utils.stream does, see STREAM_MIN
+    return sum(1 for _ in parse_feed(chunked(blob), actions))
+
+
+def measure(function, *args):
+    # time and memory in separate runs, tracemalloc slows the parsing down several times
+    durations = []
+    for _ in range(REPEAT):
+        begin = perf_counter()
+        nb = function(*args)
+        durations.append(perf_counter() - begin)
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return nb, min(durations), peak
+
+
+def main(sizes):
+    print(f"{'town':<12} {'stations':>8} {'path':<10} {'peak (MiB)':>10} {'time (s)':>9}")
+    for town, actions in ACCESS.items():
+        for size in sizes:
+            blob = json.dumps(feed(town, "dynamic", size)).encode()
+
+            for name, function in [("loads", current_path), ("streaming", streaming_path), ("adaptive", adaptive_path)]:
+                nb, duration, peak = measure(function, blob, actions)
+                assert nb == size
+                print(f"{town:<12} {size:>8} {name:<10} {peak / 2**20:>10.2f} {duration:>9.3f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
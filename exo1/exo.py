@@ -1,85 +1,71 @@
-from pymongo.errors import WriteError
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
-from utils.utils import listFiles, download, readJson, access_data
+from utils.utils import listFiles, stream, batched
+from utils.mapper import load_api
 
 
-def interpreter(field, fields, mapper):
-    atomic_mapper = mapper[field]
-    
-    if not type(atomic_mapper) == dict:
-        return fields[atomic_mapper]
-    
-    elif "addition" in atomic_mapper:
-        atomic_mapper = atomic_mapper["addition"]
-        return fields[atomic_mapper[0]] + fields[atomic_mapper[1]]
-    
-    elif "var" in atomic_mapper and "pos" in atomic_mapper:
-        return fields[atomic_mapper["var"]][atomic_mapper["pos"]]
+BOOTSTRAP_WORKERS = 8 # static feeds downloaded at the same time
+INSERT_CHUNK = 1000 # stations per insert_many
 
-    print(f"bad json structure : no interpretation for {mapper}")
-    exit(1)
 
+def insert_from_api(api):
+    print(f"starting {api['fields_mapper']['ville']}...")
 
-def insert_from_api(path):
-    api = readJson(path)["static"]
+    return map(api["transform"], stream(api['url'], api["data_access"]))
 
-    print(f"starting {api['fields_mapper']['ville']}...")
 
-    mapper = api["fields_mapper"]
-    return [{
-                "_id": f"{mapper['ville']}_{fields[mapper['_id']]}",
-                "ville": mapper['ville'],
-                "nom": fields[mapper['nom']].title(),
-                "nbvelosdispo": 0,
-                "nbplacesdispo": 0,
-                "nbplacestotal": interpreter("nbplacestotal", fields, mapper),
-                "actif": True,
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [
-                        interpreter("longitude", fields, mapper),
-                        interpreter("latitude", fields, mapper)
-                ]}
-            } for fields in access_data(download(api['url']), api["data_access"])]
-
-
-def exo1(collection, *_):
+def bootstrap(api, storage):
+    # streams one static feed into unordered chunked inserts
+    town = api['fields_mapper']['ville']
+    begin = perf_counter()
+    inserted, total = 0, 0
+
     try:
-        collection.delete_many({})
-        collection.drop_indexes()
-        print("\nLive DB cleaned")
+        for chunk in batched(insert_from_api(api), INSERT_CHUNK):
+            total += len(chunk)
+            inserted += storage.insert_stations(chunk)
+
     except Exception as e:
-        print("something went wrong...")
+        print(f"'{town}' - something went wrong...")
+        print(type(e))
         print(e)
-        exit()
 
-    try:
-        print("\nCreate 2dsphere index for 'geometry' field...")
-        result = collection.create_index([("geometry", "2dsphere")])
-        print(f"=> index name : {result}")
+    duration = perf_counter() - begin
+    print(f"=> '{town}' - inserted {inserted}/{total} lines in {duration:.2f}s")
+    return {"town": town, "inserted": inserted, "total": total, "duration": duration}
 
-        print("\nCreate text index for 'ville' field...")
-        result = collection.create_index([("ville", "text")])
-        print(f"=> index ville : {result}")
+
+def create_indexes(storage):
+    print("\nCreate live and history indexes...")
+    result = storage.create_indexes()
+    print(f"=> indexes : {result}")
+
+
+def exo1(storage, *_):
+    try:
+        storage.clear()
+        print("\nLive DB cleaned")
     except Exception as e:
         print("something went wrong...")
         print(e)
         exit()
 
-    print("\nCollect static api's datas...")
-    datas = []
-    for file in listFiles("apis"):
-        datas += insert_from_api(file)
+    apis = [load_api(file, "static") for file in listFiles("apis")]
 
-    print("Collect done - uploading...")
-    try:
-        result = collection.insert_many(datas)
-        print(f"=> inserted {len(result.inserted_ids)}/{len(datas)} lines")
+    print("\nCollect and upload static api's datas...")
+    begin = perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(BOOTSTRAP_WORKERS, len(apis)))) as executor:
+        timings = list(executor.map(bootstrap, apis, [storage] * len(apis)))
 
-    except WriteError as we:
-        print(we.details)
+    print(f"=> inserted {sum(timing['inserted'] for timing in timings)}/{sum(timing['total'] for timing in timings)} lines " +
+        f"in {perf_counter() - begin:.2f}s (slowest town : {max([timing['duration'] for timing in timings], default=0):.2f}s)")
 
+    try: # built once the data is loaded, cheaper than maintaining them insert after insert
+        create_indexes(storage)
     except Exception as e:
         print("something went wrong...")
-        print(type(e))
         print(e)
+        exit()
+
+    return timings
@@ -0,0 +1,164 @@
+from collections import deque
+from itertools import groupby
+from time import monotonic
+import threading
+
+from exo2.history import bucket_start
+
+
+FLUSH_SIZE = 5000 # samples, flush as soon as this many are waiting
+FLUSH_AGE = 5 # seconds, flush when the oldest waiting sample is this old
+CAPACITY = 50000 # samples, push blocks then sheds above this
+PUSH_TIMEOUT = 2 # seconds a full buffer makes a pusher wait before shedding
+SHUTDOWN_POLL = 0.5 # seconds between two checks of evt_end
+MAX_RETRIES = 3 # failed writes of a bucket before its samples are dropped
+
+
+class HistoryBuffer:
+    # write-behind buffer shared by every refresh : samples are coalesced per bucket and
+    # flushed through the storage into history and the rollups
+    # each of the two retries its own failed buckets, so a failure of one doesn't skip or replay the other
+
+    def __init__(self, storage, flush_size=FLUSH_SIZE, flush_age=FLUSH_AGE, capacity=CAPACITY):
+        self.storage = storage
+        self.flush_size = flush_size
+        self.flush_age = flush_age
+        self.capacity = capacity
+
+        self.samples = deque() # (station_id, sample)
+        self.oldest = None # monotonic time of the first waiting sample
+        self.condition = threading.Condition()
+        self.closed = False # no more push once the shutdown drain started
+
+        self.retries = {"history": [], "rollups": []} # (station_id, samples, attempts) of the failed writes
+        self.retry_at = None # monotonic time of the next retry
+
+        self.dropped = 0 # samples not in history : shed, pushed after close or given up
+        self.rollups_dropped = 0 # samples in history but given up on the rollups
+        self.written = 0
+        self.flushes = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+
+
+    def push(self, samples):
+        with self.condition:
+            if self.closed:
+                self.dropped += len(samples)
+                return 0
+
+            room = lambda: self.capacity - len(self.samples)
+            if room() < len(samples):
+                self.condition.notify_all() # wake the flusher up
+                self.condition.wait_for(lambda: room() >= len(samples), timeout=PUSH_TIMEOUT)
+
+            if room() < len(samples): # still full, shed the newest samples
+                self.dropped += len(samples) - max(room(), 0)
+                samples = samples[:max(room(), 0)]
+
+            if samples and not self.samples:
+                self.oldest = monotonic()
+            self.samples.extend(samples)
+
+            if len(self.samples) >= self.flush_size:
+                self.condition.notify_all()
+
+        return len(samples)
+
+
+    def due(self):
+        return len(self.samples) >= self.flush_size or \
+            (self.oldest is not None and monotonic() - self.oldest >= self.flush_age) or \
+            (self.retry_at is not None and monotonic() >= self.retry_at)
+
+
+    def write(self, target, groups):
+        # target : "history" or "rollups", see Storage.write_history ; returns the groups that failed
+        if not groups:
+            return []
+
+        try:
+            failed = getattr(self.storage, f"write_{target}")([(station_id, samples) for station_id, samples, _ in groups])
+            return [groups[position] for position in failed]
+
+        except Exception as e:
+            print(f"History buffer - {target} - something went wrong...")
+            print(type(e))
+            print(e)
+            return groups
+
+
+    def flush(self):
+        with self.condition:
+            batch = [self.samples.popleft() for _ in range(min(len(self.samples), self.flush_size))]
+            self.oldest = monotonic() if self.samples else None
+            self.condition.notify_all() # room for the blocked pushers
+
+        key = lambda item: (item[0], bucket_start(item[1]["record_timestamp"]))
+        groups = [(station_id, [sample for _, sample in group], 0)
+                    for (station_id, _), group in groupby(sorted(batch, key=key), key=key)]
+        retries, self.retries = self.retries, {"history": [], "rollups": []}
+        if not groups and not any(retries.values()):
+            self.retry_at = None
+            return 0
+
+        begin = monotonic()
+        written = {}
+        for target in ["history", "rollups"]:
+            pending = groups + retries[target]
+            failed = self.write(target, pending)
+            written[target] = sum(len(samples) for _, samples, _ in pending) - sum(len(samples) for _, samples, _ in failed)
+
+            for station_id, samples, attempts in failed:
+                if attempts + 1 < MAX_RETRIES:
+                    self.retries[target].append((station_id, samples, attempts + 1))
+                elif target == "history":
+                    self.dropped += len(samples)
+                else:
+                    self.rollups_dropped += len(samples)
+
+        self.written += written["history"]
+        self.retry_at = monotonic() + self.flush_age if any(self.retries.values()) else None
+
+        latency = monotonic() - begin
+        self.flushes += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+
+        print(f"=> History buffer - {len(batch)} new samples, written {written['history']} in history and " +
+            f"{written['rollups']} in the rollups - {self.metrics()}")
+        return len(batch) + sum(len(samples) for target in retries.values() for _, samples, _ in target)
+
+
+    def metrics(self):
+        return {
+            "depth": len(self.samples),
+            "dropped": self.dropped,
+            "rollups_dropped": self.rollups_dropped,
+            "retrying": sum(len(samples) for target in self.retries.values() for _, samples, _ in target),
+            "written": self.written,
+            "flushes": self.flushes,
+            "last_flush_latency": round(self.last_latency, 4),
+            "max_flush_latency": round(self.max_latency, 4),
+            "avg_flush_latency": round(self.total_latency / self.flushes, 4) if self.flushes else 0
+        }
+
+
+    def run(self, evt_end):
+        print("start history buffer")
+
+        try:
+            while not evt_end.is_set():
+                with self.condition:
+                    self.condition.wait_for(self.due, timeout=SHUTDOWN_POLL)
+                if self.due():
+                    self.flush()
+
+        finally:
+            with self.condition:
+                self.closed = True # later pushes are counted as dropped instead of lost after the drain
+            while self.flush(): # drain on shutdown, failed writes are retried until given up
+                pass
+            print("close history buffer")
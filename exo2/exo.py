@@ -1,92 +1,173 @@
-from pymongo import UpdateOne, InsertOne
-from pymongo.errors import BulkWriteError
 from datetime import datetime
 
+import asyncio
+import random
 import threading
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 
-from utils.utils import listFiles, download, readJson, access_data
+from utils.utils import listFiles, stream
+from utils.mapper import load_api
+from exo2.history import sample
+from exo2.buffer import HistoryBuffer
+
+
+MAX_DOWNLOADS = 8 # feeds downloaded at the same time
+MAX_WRITERS = 4 # threads running the mongo writes
+MAX_JITTER = 5 # seconds, spreads the first tick of each city
+SHUTDOWN_POLL = 0.5 # seconds between two checks of evt_end
+
+refresh_listeners = [] # called with (town, changed stations) once their new counts are in live
+
+
+def add_refresh_listener(listener):
+    refresh_listeners.append(listener)
 
 
 def update_from_api(api):
-    mapper = api["fields_mapper"]
-    return [{
-                "_id": f"{mapper['ville']}_{fields[mapper['_id']]}",
-                "nbvelosdispo": fields[mapper['nbvelosdispo']],
-                "nbplacesdispo": fields[mapper['nbplacesdispo']]
-            } for fields in access_data(download(api['url']), api["data_access"])]
+    records = stream(api['url'], api["data_access"], conditional=True)
+    if records is None:
+        return None # feed unchanged
 
+    return list(map(api["transform"], records))
 
-def refresh(api, collection_live, collection_history):
-    datas = update_from_api(api)
-    town = api['fields_mapper']['ville']
 
-    try:
-        result = collection_live.bulk_write([
-            UpdateOne(
-                {"_id": data["_id"]},
-                {"$set": {
-                    "nbvelosdispo": data["nbvelosdispo"],
-                    "nbplacesdispo": data["nbplacesdispo"]
-                }}
-            )
-            for data in datas]).bulk_api_result
-
-        print(f"=> '{town}' - Live collection - " +
-            f"updated {result['nModified']}/{result['nMatched']}/{len(datas)} lines")
-
-    except BulkWriteError as bwe:
-        print(f"'{town}' - Live collection - bulk_write error :")
-        print(f"Index : {bwe.details['writeErrors']['index']}")
-        print(f"Message : {bwe.details['writeErrors']['errmsg']}")
+def diff_counts(datas, last_seen):
+    return [data for data in datas
+            if last_seen.get(data["_id"]) != (data["nbvelosdispo"], data["nbplacesdispo"])]
 
-    except Exception as e:
-        print("something went wrong...")
-        print(type(e))
-        print(e)
+
+def refresh(api, storage, history, last_seen):
+    return store(api['fields_mapper']['ville'], update_from_api(api), storage, history, last_seen)
+
+
+def store(town, datas, storage, history, last_seen):
+    # history : HistoryBuffer the samples of the changed stations are pushed into
+    if datas is None:
+        print(f"=> '{town}' - tick - feed unchanged")
+        return {"changed": 0, "unchanged": len(last_seen)}
+
+    changed = diff_counts(datas, last_seen)
+    counters = {
+        "changed": len(changed),
+        "unchanged": len(datas) - len(changed)
+    }
+    print(f"=> '{town}' - tick - {counters['changed']} changed / {counters['unchanged']} unchanged stations")
+
+    if not changed:
+        return counters
 
     try:
-        insert_timestamp = datetime.utcnow()
-        result = collection_history.bulk_write([
-            InsertOne({
-                "station_id": data["_id"],
-                "nbvelosdispo": data["nbvelosdispo"],
-                "nbplacesdispo": data["nbplacesdispo"],
-                "record_timestamp": insert_timestamp
-            })
-            for data in datas]).bulk_api_result
-
-        print(f"=> '{town}' - History collection - inserted {result['nInserted']}/{len(datas)} lines")
-
-    except BulkWriteError as bwe:
-        print(f"'{town}' - History collection - bulk_write error :")
-        print(f"Index : {bwe.details['writeErrors']['index']}")
-        print(f"Message : {bwe.details['writeErrors']['errmsg']}")
+        matched = storage.update_counts(changed)
+        print(f"=> '{town}' - Live collection - updated {matched}/{len(changed)} lines")
+
+        if matched < len(changed):
+            # stations deleted from live but still in the feed : no history, it would undo their purge
+            existing = storage.existing([data["_id"] for data in changed])
+            for data in changed:
+                if data["_id"] not in existing:
+                    last_seen.pop(data["_id"], None)
+            changed = [data for data in changed if data["_id"] in existing]
+
+        for data in changed:
+            last_seen[data["_id"]] = (data["nbvelosdispo"], data["nbplacesdispo"])
+
+        for listener in refresh_listeners:
+            listener(town, changed)
 
     except Exception as e:
         print("something went wrong...")
         print(type(e))
         print(e)
 
+    insert_timestamp = datetime.utcnow()
+    pushed = history.push([(data["_id"], sample(data, insert_timestamp)) for data in changed])
+    print(f"=> '{town}' - History buffer - queued {pushed}/{len(changed)} samples")
+
+    return counters
+
+
+async def wait_until(deadline, evt_end):
+    loop = asyncio.get_running_loop()
+    while not evt_end.is_set():
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, SHUTDOWN_POLL))
+
 
-def worker(path, collection_live, collection_history, evt_end):
-    api = readJson(path)["dynamic"]
+async def city_loop(api, storage, history, evt_end, downloads, executors):
+    loop = asyncio.get_running_loop()
     town = api['fields_mapper']['ville']
+    period = api["refresh_time"] # seconds
+    last_seen = {} # station id => (nbvelosdispo, nbplacesdispo) last written
     print(f"start refresh worker '{town}'")
 
+    next_tick = loop.time() + random.uniform(0, min(MAX_JITTER, period))
     try:
         while not evt_end.is_set():
-            refresh(api, collection_live, collection_history)
-            sleep(api["refresh_time"]) # seconds
+            await wait_until(next_tick, evt_end)
+            if evt_end.is_set():
+                break
+
+            try:
+                async with downloads:
+                    datas = await loop.run_in_executor(executors["download"], update_from_api, api)
+
+                await loop.run_in_executor(executors["write"], store,
+                                            town, datas, storage, history, last_seen)
+            except Exception as e:
+                print(f"'{town}' - refresh failed...")
+                print(type(e))
+                print(e)
+
+            # fixed rate : stay on the tick grid, skip the ticks missed by a slow refresh
+            next_tick += period
+            late = loop.time() - next_tick
+            if late > 0:
+                next_tick += (late // period + 1) * period
 
     finally:
         print(f"close refresh worker '{town}'")
+
+
+async def scheduler(apis, storage, history, evt_end):
+    downloads = asyncio.Semaphore(MAX_DOWNLOADS)
+    executors = {
+        "download": ThreadPoolExecutor(max_workers=MAX_DOWNLOADS, thread_name_prefix="download"),
+        "write": ThreadPoolExecutor(max_workers=MAX_WRITERS, thread_name_prefix="write")
+    }
+
+    try:
+        await asyncio.gather(*[
+            city_loop(api, storage, history, evt_end, downloads, executors)
+            for api in apis])
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+
+def worker(apis, storage, history, evt_end):
+    try:
+        asyncio.run(scheduler(apis, storage, history, evt_end))
+
+    finally:
         evt_end.set()
 
 
-def exo2(collection_live, collection_history, evt_end):
-    for file in listFiles("apis"):
-        args = (file, collection_live, collection_history, evt_end)
-        thread = (threading.Thread(target=worker, args=args))
+def exo2(storage, evt_end):
+    apis = [load_api(file, "dynamic") for file in listFiles("apis")]
+    storage.create_indexes() # already there after exo1, the history ones are needed by the first flush
+
+    history = HistoryBuffer(storage)
+    thread = (threading.Thread(target=history.run, args=(evt_end,)))
+    thread.start() # not a daemon : the last samples are flushed before the program ends
+
+    args = (apis, storage, history, evt_end)
+    thread = (threading.Thread(target=worker, args=args))
+    thread.setDaemon(True)
+    thread.start()
+
+    for function, args in storage.workers(): # retention and purge of the history, see Storage.workers
+        thread = (threading.Thread(target=function, args=(*args, evt_end)))
         thread.setDaemon(True)
         thread.start()
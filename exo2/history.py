@@ -0,0 +1,244 @@
+from pymongo import UpdateOne
+from bson import ObjectId
+from itertools import groupby
+from datetime import timezone
+from zoneinfo import ZoneInfo
+
+# history layout : one bucket per station and per hour
+# {
+#     "_id": "<station_id>_<YYYYMMDDHH>",
+#     "station_id": "<station_id>",
+#     "record_timestamp": <start of the hour>,
+#     "dayOfWeek", "hourOfDay": <local day and hour of the bucket, in TIMEZONE>,
+#     "nbsamples": <raw samples represented>,
+#     "samples": [{"record_timestamp", "nbvelosdispo", "nbplacesdispo"}, ...]
+# }
+# once older than the retention windows (see exo2.retention) a bucket gets a "resolution" (seconds)
+# and its samples become averages over that resolution, weighted by their own "nbsamples"
+
+# rollup layout : running sums per station, local weekday and hour, same day/hour convention as $dayOfWeek/$hour
+# {
+#     "_id": "<station_id>_<dayOfWeek>_<hourOfDay>",
+#     "station_id", "dayOfWeek", "hourOfDay",
+#     "sum_velos", "sum_places", "nbsamples"
+# }
+
+TIMEZONE = "Europe/Paris" # stations' local time, for the stored days and hours
+ROLLUPS = "history_rollups"
+MIGRATION_BATCH = 5000 # raw documents moved at once
+FIRST_OBJECT_ID = ObjectId("0" * 24) # raw rows have ObjectId keys, buckets string keys
+
+
+def bucket_start(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def day_of_week(timestamp):
+    return timestamp.isoweekday() % 7 + 1 # 1 sunday ... 7 saturday
+
+
+def local_day_hour(timestamp):
+    # naive utc timestamp => (dayOfWeek, hourOfDay) in TIMEZONE
+    local = timestamp.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE))
+    return day_of_week(local), local.hour
+
+
+def bucket_id(station_id, start):
+    return f"{station_id}_{start:%Y%m%d%H}"
+
+
+def bucket_update(station_id, samples, migrated=None):
+    # samples : same station, same hour ; migrated : raw _ids the samples come from, see migrate
+    start = bucket_start(samples[0]["record_timestamp"])
+    day, hour = local_day_hour(start) # whole hours offsets, the bucket stays in one local hour
+    push = {
+        "samples": {
+            "$each": samples
+        }
+    }
+    if migrated:
+        push["migrated"] = {"$each": migrated}
+
+    return UpdateOne(
+        {"_id": bucket_id(station_id, start)},
+        {
+            "$setOnInsert": {
+                "station_id": station_id,
+                "record_timestamp": start,
+                "dayOfWeek": day,
+                "hourOfDay": hour
+            },
+            "$push": push,
+            "$inc": {
+                "nbsamples": len(samples)
+            }
+        },
+        upsert=True)
+
+
+def rollups(collection_history):
+    return collection_history.database[ROLLUPS]
+
+
+def rollup_update(station_id, samples):
+    # samples : same station, same hour
+    day, hour = local_day_hour(samples[0]["record_timestamp"])
+    return UpdateOne(
+        {"_id": f"{station_id}_{day}_{hour}"},
+        {
+            "$setOnInsert": {
+                "station_id": station_id,
+                "dayOfWeek": day,
+                "hourOfDay": hour
+            },
+            "$inc": {
+                "sum_velos": sum(sample["nbvelosdispo"] for sample in samples),
+                "sum_places": sum(sample["nbplacesdispo"] for sample in samples),
+                "nbsamples": len(samples)
+            }
+        },
+        upsert=True)
+
+
+def create_history_indexes(collection_history):
+    return [
+        collection_history.create_index([("station_id", 1), ("record_timestamp", 1)]),
+        collection_history.create_index([("resolution", 1), ("record_timestamp", 1)]),
+        collection_history.create_index([("dayOfWeek", 1), ("hourOfDay", 1), ("record_timestamp", 1)]),
+        collection_history.create_index([("record_timestamp", 1)]), # stats window outside Europe/Paris, see exo4_5
+        rollups(collection_history).create_index([("dayOfWeek", 1), ("hourOfDay", 1)]),
+        rollups(collection_history).create_index([("station_id", 1)])
+    ]
+
+
+def rebuild_rollups(collection_history):
+    # recompute every rollup from the buckets, the rollup collection is replaced by $out once the sums are done
+    # the refresh must be stopped meanwhile (exo2, service --refresh) : the $inc it makes on the old collection
+    # are lost with it, and the samples written during the aggregation may or may not be in the new sums
+    aggregation = [
+        {
+            "$unwind": "$samples"
+        },
+        {
+            "$group": {
+                "_id": {
+                    "station": "$station_id",
+                    "dayOfWeek": {
+                        "$ifNull": ["$dayOfWeek", {"$dayOfWeek": {"date": "$record_timestamp", "timezone": TIMEZONE}}]
+                    },
+                    "hourOfDay": {
+                        "$ifNull": ["$hourOfDay", {"$hour": {"date": "$record_timestamp", "timezone": TIMEZONE}}]
+                    }
+                },
+                "sum_velos": {
+                    "$sum": {
+                        "$multiply": ["$samples.nbvelosdispo", {"$ifNull": ["$samples.nbsamples", 1]}]
+                    }
+                },
+                "sum_places": {
+                    "$sum": {
+                        "$multiply": ["$samples.nbplacesdispo", {"$ifNull": ["$samples.nbsamples", 1]}]
+                    }
+                },
+                "nbsamples": {
+                    "$sum": {
+                        "$ifNull": ["$samples.nbsamples", 1]
+                    }
+                }
+            }
+        },
+        {
+            "$project": {
+                "_id": {
+                    "$concat": [
+                        "$_id.station", "_",
+                        {"$toString": "$_id.dayOfWeek"}, "_",
+                        {"$toString": "$_id.hourOfDay"}
+                    ]
+                },
+                "station_id": "$_id.station",
+                "dayOfWeek": "$_id.dayOfWeek",
+                "hourOfDay": "$_id.hourOfDay",
+                "sum_velos": 1,
+                "sum_places": 1,
+                "nbsamples": 1
+            }
+        },
+        {
+            "$out": ROLLUPS
+        }
+    ]
+
+    collection_history.aggregate(aggregation)
+    create_history_indexes(collection_history)
+    print(f"=> Rollup collection - rebuilt {rollups(collection_history).estimated_document_count()} lines")
+
+
+def sample(data, timestamp):
+    return {
+        "record_timestamp": timestamp,
+        "nbvelosdispo": data["nbvelosdispo"],
+        "nbplacesdispo": data["nbplacesdispo"]
+    }
+
+
+def migrate(collection_history, batch_size=MIGRATION_BATCH):
+    # moves raw rows {station_id, nbvelosdispo, nbplacesdispo, record_timestamp} into buckets, resumable :
+    # a bucket keeps the raw _ids it got in "migrated" until the end, so a batch interrupted before its
+    # delete is not pushed twice by the next run
+    moved = 0
+    while True:
+        raws = list(collection_history.find({"_id": {"$gte": FIRST_OBJECT_ID}}).sort("_id", 1).limit(batch_size))
+        if not raws:
+            break
+
+        key = lambda raw: (raw["station_id"], bucket_start(raw["record_timestamp"]))
+        ids = [raw["_id"] for raw in raws]
+        buckets = collection_history.find({"_id": {"$in": list({bucket_id(*key(raw)) for raw in raws})}, "migrated": {"$in": ids}},
+                                        {"migrated": 1})
+        done = {raw_id for bucket in buckets for raw_id in bucket["migrated"]} & set(ids) # pushed by an interrupted run
+
+        operations = []
+        for (station_id, _), group in groupby(sorted([raw for raw in raws if raw["_id"] not in done], key=key), key=key):
+            group = list(group)
+            operations.append(bucket_update(station_id, [sample(raw, raw["record_timestamp"]) for raw in group],
+                                            [raw["_id"] for raw in group]))
+
+        if operations:
+            collection_history.bulk_write(operations, ordered=False)
+        collection_history.delete_many({"_id": {"$in": ids}})
+
+        moved += len(raws)
+        print(f"=> History collection - {moved} raw lines moved into buckets ({len(done)} already in their bucket)")
+
+    result = collection_history.update_many({"migrated": {"$exists": True}}, {"$unset": {"migrated": ""}})
+    print(f"=> History collection - migration marks removed from {result.modified_count} buckets")
+
+    # buckets written before the local days and hours were stored
+    result = collection_history.update_many({"dayOfWeek": {"$exists": False}}, [
+        {
+            "$set": {
+                "dayOfWeek": {"$dayOfWeek": {"date": "$record_timestamp", "timezone": TIMEZONE}},
+                "hourOfDay": {"$hour": {"date": "$record_timestamp", "timezone": TIMEZONE}}
+            }
+        }
+    ])
+    print(f"=> History collection - local day and hour added to {result.modified_count} buckets")
+
+    return moved
+
+
+if __name__ == "__main__":
+    import sys
+    from main import connectDB
+
+    commands = {
+        "migrate": migrate,
+        "rebuild": rebuild_rollups
+    }
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(f"usage : python -m exo2.history [{'|'.join(commands)}]")
+        print("stop the refresh before a rebuild, the rollups it writes meanwhile are lost")
+        exit(1)
+
+    commands[sys.argv[1]](connectDB("credentials.json").TP1.history)
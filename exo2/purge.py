@@ -0,0 +1,120 @@
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+
+from exo2.history import rollups
+from exo2.buffer import FLUSH_AGE, MAX_RETRIES
+
+# purge job layout : one document per deletion request, resumed as long as it is not done
+# {
+#     "_id": <ObjectId>,
+#     "station_ids": ["<station_id>", ...],
+#     "state": "pending" | "running" | "done",
+#     "created_at", "updated_at", "finished_at",
+#     "total": <history buckets found when the job started>,
+#     "deleted": <history buckets deleted so far>
+# }
+
+PURGE_JOBS = "purge_jobs"
+PURGE_BATCH = 1000 # history buckets deleted at once
+PURGE_PAUSE = 0.2 # seconds between two batches, leaves room to the refresh
+PURGE_POLL = 5 # seconds between two looks for new jobs
+# seconds a job waits before it starts : samples pushed before the delete are written by then, retries included,
+# instead of recreating buckets of the purged stations, see exo2.buffer
+PURGE_DELAY = FLUSH_AGE * (MAX_RETRIES + 1)
+
+
+def purge_jobs(collection_history):
+    return collection_history.database[PURGE_JOBS]
+
+
+def enqueue_purge(collection_history, station_ids):
+    # cheap enough for the gui thread, the history itself is deleted by purge_worker
+    now = datetime.utcnow()
+    job = {
+        "station_ids": list(station_ids),
+        "state": "pending",
+        "created_at": now,
+        "updated_at": now,
+        "deleted": 0
+    }
+    return purge_jobs(collection_history).insert_one(job).inserted_id
+
+
+def claim(collection_history):
+    # oldest unfinished job old enough, a "running" one was interrupted and is resumed
+    return purge_jobs(collection_history).find_one_and_update(
+        {"state": {"$in": ["pending", "running"]}, "created_at": {"$lte": datetime.utcnow() - timedelta(seconds=PURGE_DELAY)}},
+        {"$set": {"state": "running", "updated_at": datetime.utcnow()}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER)
+
+
+def purge(collection_history, job, evt_end, batch_size=PURGE_BATCH):
+    # deletes are idempotent : after a crash the remaining buckets are simply found again
+    jobs = purge_jobs(collection_history)
+    match = {"station_id": {"$in": job["station_ids"]}} # (station_id, record_timestamp) index
+
+    if "total" not in job:
+        job["total"] = job["deleted"] + collection_history.count_documents(match)
+        jobs.update_one({"_id": job["_id"]}, {"$set": {"total": job["total"]}})
+
+    while not evt_end.is_set():
+        batch = [bucket["_id"] for bucket in collection_history.find(match, {"_id": 1}).limit(batch_size)]
+        if not batch:
+            break
+
+        deleted = collection_history.delete_many({"_id": {"$in": batch}}).deleted_count
+        job["deleted"] += deleted
+        jobs.update_one({"_id": job["_id"]}, {
+            "$inc": {"deleted": deleted},
+            "$set": {"updated_at": datetime.utcnow()}
+        })
+        print(f"=> Purge {job['_id']} - {job['deleted']}/{job['total']} history buckets deleted")
+        evt_end.wait(PURGE_PAUSE)
+
+    else:
+        return False # interrupted, resumed on next start
+
+    result = rollups(collection_history).delete_many(match)
+    jobs.update_one({"_id": job["_id"]}, {
+        "$set": {"state": "done", "updated_at": datetime.utcnow(), "finished_at": datetime.utcnow()}
+    })
+    print(f"=> Purge {job['_id']} - done, {len(job['station_ids'])} stations, " +
+        f"{job['deleted']} history buckets and {result.deleted_count} rollups deleted")
+    return True
+
+
+def purge_worker(collection_history, evt_end):
+    print("start purge worker")
+
+    try:
+        purge_jobs(collection_history).create_index([("state", 1), ("created_at", 1)])
+
+        while not evt_end.is_set():
+            try:
+                job = claim(collection_history)
+                if job:
+                    purge(collection_history, job, evt_end)
+                    continue
+
+            except Exception as e:
+                print("purge failed...")
+                print(type(e))
+                print(e)
+
+            evt_end.wait(PURGE_POLL)
+
+    finally:
+        print("close purge worker")
+
+
+def status(collection_history):
+    for job in purge_jobs(collection_history).find({}).sort("created_at", -1):
+        print(f"{job['_id']}  {job['state']:<8} {len(job['station_ids']):>5} stations  " +
+            f"{job['deleted']}/{job.get('total', '?')} buckets  updated {job['updated_at']:%Y-%m-%d %H:%M:%S}")
+
+
+if __name__ == "__main__":
+    from main import connectDB
+
+    status(connectDB("credentials.json").TP1.history)
@@ -0,0 +1,107 @@
+from pymongo import UpdateOne
+from datetime import datetime, timedelta
+from bson import encode
+
+from exo2.history import bucket_start
+
+
+RAW_RETENTION = timedelta(days=7) # raw samples kept
+QUARTER_RETENTION = timedelta(days=30) # 15 minutes averages kept, hourly averages after
+QUARTER = 15 * 60 # seconds
+HOUR = 60 * 60 # seconds
+
+RETENTION_BATCH = 500 # buckets rewritten at once
+RETENTION_PAUSE = 0.2 # seconds between two batches, leaves room to the refresh
+RETENTION_PERIOD = 60 * 60 # seconds between two runs
+
+
+def downsample(samples, resolution):
+    # weighted averages of the samples over windows of resolution seconds
+    windows = {}
+    for sample in samples:
+        timestamp = sample["record_timestamp"]
+        start = timestamp - timedelta(seconds=(timestamp.minute * 60 + timestamp.second) % resolution,
+                                        microseconds=timestamp.microsecond)
+        weight = sample.get("nbsamples", 1)
+
+        window = windows.setdefault(start, [0, 0, 0])
+        window[0] += sample["nbvelosdispo"] * weight
+        window[1] += sample["nbplacesdispo"] * weight
+        window[2] += weight
+
+    return [{
+        "record_timestamp": start,
+        "nbvelosdispo": velos / weight,
+        "nbplacesdispo": places / weight,
+        "nbsamples": weight
+    } for start, (velos, places, weight) in sorted(windows.items())]
+
+
+def downsample_tier(collection_history, current, resolution, cutoff, evt_end, batch_size):
+    # current : resolution of the buckets to rewrite, None for raw buckets
+    filter = {
+        "resolution": current,
+        "record_timestamp": {
+            "$lt": bucket_start(cutoff)
+        },
+        "samples": {
+            "$exists": True # raw rows not migrated yet (see exo2.history.migrate) are left alone
+        }
+    }
+
+    buckets, reclaimed = 0, 0
+    while not evt_end.is_set():
+        batch = list(collection_history.find(filter).sort("record_timestamp", 1).limit(batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for bucket in batch:
+            samples = downsample(bucket["samples"], resolution)
+            operations.append(UpdateOne(
+                {"_id": bucket["_id"], "resolution": current},
+                {"$set": {"samples": samples, "resolution": resolution}}))
+            reclaimed += len(encode(bucket)) - len(encode({**bucket, "samples": samples, "resolution": resolution}))
+
+        collection_history.bulk_write(operations, ordered=False)
+        buckets += len(batch)
+        evt_end.wait(RETENTION_PAUSE)
+
+    return buckets, reclaimed
+
+
+def retention(collection_history, evt_end, raw_retention=RAW_RETENTION, quarter_retention=QUARTER_RETENTION,
+                batch_size=RETENTION_BATCH):
+    now = datetime.utcnow()
+    tiers = [
+        (None, QUARTER, now - raw_retention),
+        (QUARTER, HOUR, now - quarter_retention)
+    ]
+
+    total = 0
+    for current, resolution, cutoff in tiers:
+        buckets, reclaimed = downsample_tier(collection_history, current, resolution, cutoff, evt_end, batch_size)
+        if buckets:
+            print(f"=> History collection - {buckets} buckets downsampled to {resolution // 60} minutes")
+        total += reclaimed
+
+    print(f"=> History collection - retention reclaimed {total} bytes")
+    return total
+
+
+def retention_worker(collection_history, evt_end):
+    print("start retention worker")
+
+    try:
+        while not evt_end.is_set():
+            try:
+                retention(collection_history, evt_end)
+            except Exception as e:
+                print("retention failed...")
+                print(type(e))
+                print(e)
+
+            evt_end.wait(RETENTION_PERIOD)
+
+    finally:
+        print("close retention worker")
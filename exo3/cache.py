@@ -0,0 +1,83 @@
+from collections import OrderedDict
+import threading
+
+
+CACHE_SIZE = 1024 # results kept
+QUANTUM = 4 # decimals kept on the coordinates of a key, ~10 metres
+ANY_TOWN = "*" # entries computed without knowing which towns they depend on
+
+
+class ResultCache:
+    # LRU of nearest-station results, an entry is stale as soon as one of its towns is refreshed
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict() # key => (result, {town: generation})
+        self.generations = {} # town => number of refreshes that wrote new counts
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+    @staticmethod
+    def key(coordinates, minDistance, maxDistance, closest):
+        return (round(coordinates[0], QUANTUM), round(coordinates[1], QUANTUM), minDistance, maxDistance, closest)
+
+
+    def stamp(self, towns):
+        # taken before computing a result, so a refresh running meanwhile makes it stale
+        with self.lock:
+            return {town: self.generations.get(town, 0) for town in (towns if towns is not None else [ANY_TOWN])}
+
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            result, stamp = entry
+            if any(self.generations.get(town, 0) != generation for town, generation in stamp.items()):
+                del self.entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+
+    def put(self, key, result, stamp):
+        with self.lock:
+            self.entries[key] = (result, stamp)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def invalidate(self, town, datas):
+        # refresh listener : called only when new counts were written for town
+        with self.lock:
+            self.generations[town] = self.generations.get(town, 0) + 1
+            self.generations[ANY_TOWN] = self.generations.get(ANY_TOWN, 0) + 1
+
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+resultCache = ResultCache()
@@ -1,153 +1,39 @@
 from guizero import App, Box, Text, PushButton, ListBox
 
-from utils.utils import formGenerator
-
-
-def getClosestStations(collection, coordinates, minDistance, maxDistance, closest):
-    # filter = {
-    #     "geometry": { 
-    #         "$near": {
-    #             "$geometry": {
-    #                 "type": 'Point',
-    #                 "coordinates": coordinates
-    #             },
-    #             "$minDistance": minDistance,
-    #             "$maxDistance": maxDistance
-    #         },
-    #     },
-    #     "nbvelosdispo": {
-    #         "$gt": 0
-    #     }
-    # }
-    projection = {
-        "_id": 0,
-        "nom": 1,
-        "velos": "$nbvelosdispo",
-        "places": "$nbplacesdispo"
-    }
-
-    # query = collection.find(filter, projection).limit(closest)
-
-    aggregation = [
-        {
-            "$geoNear": {
-                "near": {
-                    "type": "Point",
-                    "coordinates": coordinates
-                }, 
-                "minDistance": minDistance,
-                "maxDistance": maxDistance,
-                "distanceField": "distance"
-            }
-        },
-        {
-            "$match": {
-                "nbvelosdispo": {
-                    "$gt": 0
-                }
-            }
-        },
-        {
-            "$project": {
-                **projection,
-                "distance": {
-                    "$concat": [
-                        {
-                            "$substr": [
-                                {
-                                    "$round": ["$distance", 2]
-                                },
-                                0,
-                                -1
-                            ]
-                        },
-                        " mètres"
-                    ]
-                },
-                "direction": {
-                    "$let": {
-                        "vars": {
-                            "lon": {
-                                "$arrayElemAt": ["$geometry.coordinates", 0]
-                            },
-                            "lat": {
-                                "$arrayElemAt": ["$geometry.coordinates", 1]
-                            }
-                        },
-                        "in": {
-                            "$concat": [
-                                {
-                                    "$cond": {
-                                        "if": {
-                                            "$eq": ["$$lat", coordinates[1]]
-                                        },
-                                        "then": "",
-                                        "else": {
-                                            "$cond": {
-                                                "if": {
-                                                    "$gt": ["$$lat", coordinates[1]]
-                                                },
-                                                "then": "Nord ",
-                                                "else": "Sud "
-                                            }
-                                        }
-                                    }
-                                },
-                                {
-                                    "$cond": {
-                                        "if": {
-                                            "$eq": ["$$lon", coordinates[0]]
-                                        },
-                                        "then": "",
-                                        "else": {
-                                            "$cond": {
-                                                "if": {
-                                                    "$lt": ["$$lon", coordinates[0]]
-                                                },
-                                                "then": "Ouest",
-                                                "else": "Est"
-                                            }
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    }
-                }
-            }
-        },
-        {
-            "$facet": {
-                "closest_results": [
-                    { 
-                        "$limit": closest
-                    }
-                ],
-                "total": [
-                    {
-                        "$count": 'nb_stations'
-                    }
-                ]
-            }
-        },
-        {
-            "$unwind": "$total"
-        },
-        {
-            "$project": {
-                "closest_results": 1,
-                "nb_stations":  "$total.nb_stations"
-            }
-        }
-    ]
+from utils.gui import formGenerator
+from utils.executor import QueryExecutor
+from exo2.exo import add_refresh_listener
+from exo3.queries import getClosestStations
+from exo3.spatial import stationIndex
+from exo3.cache import resultCache
+from math import radians, sin, cos
+from concurrent.futures import CancelledError
+
+
+def formatDistance(distance):
+    return f"{distance:.2f}".rstrip("0").rstrip(".") + " mètres"
 
-    return collection.aggregate(aggregation)
 
+def formatDirection(direction):
+    north, east = cos(radians(direction)), sin(radians(direction))
+    return ("" if abs(north) < 1e-9 else "Nord " if north > 0 else "Sud ") + \
+        ("" if abs(east) < 1e-9 else "Est" if east > 0 else "Ouest")
 
-def exo3(collection, *_):
+
+def exo3(storage, *_):
+    add_refresh_listener(stationIndex.update)
+    add_refresh_listener(resultCache.invalidate) # after the index, see ResultCache.stamp
+    try:
+        stationIndex.load(storage)
+    except Exception as e:
+        print("station index unavailable, falling back to the storage query...")
+        print(e)
+
+    executor = QueryExecutor()
     try:
         app = App(title="Client", height="600", width="800")
         app.tk.resizable(False, False)  # everything will be absolutely relative
+        executor.start(app)
 
         Box(app, height="10")  # margin
 
@@ -186,14 +72,18 @@ def exo3(collection, *_):
         Text(box, align="left", text="Nb de stations totales : ")
         resultNb = Text(box, align="left")
 
-        PushButton(app, text="Rechercher", width="16", command=displayStations, args=(collection, inputs, resultList, resultNb))
+        PushButton(app, text="Rechercher", width="16", command=displayStations, args=(storage, inputs, resultList, resultNb, executor))
 
         app.display()
     except Exception as e:
         print(e)
+    finally:
+        executor.shutdown()
+
+    print(f"=> Result cache - {resultCache.stats()}")
 
 
-def displayStations(collection, inputs, containerList, containerNb):
+def displayStations(storage, inputs, containerList, containerNb, executor):
     containerList.clear()
     containerNb.clear()
 
@@ -203,16 +93,38 @@ def displayStations(collection, inputs, containerList, containerNb):
                 float(inputs["maxDist"]["ptr"].value),
                 int(inputs["limit"]["ptr"].value))
 
-        result = list(getClosestStations(collection, *args))[0]
-        for elem in result["closest_results"]:
-            containerList.append(f"'{elem['nom']}' est à {elem['distance']} direction {elem['direction']} avec {elem['velos']} vélos dispos et {elem['places']} places libres")
-
-        containerNb.append(result["nb_stations"])
-
-    except IndexError:
-        containerNb.append(0)
-
     except Exception as e:
         print("something went wrong...")
         print(type(e))
         print(e)
+        return
+
+    key = ("closest", tuple(args[0]), *args[1:]) # same search clicked again while running : one query
+    executor.submit("closest", key, getClosestStations, (storage, *args),
+                    lambda result: showStations(result, containerList, containerNb),
+                    lambda error: queryFailed(error, containerNb))
+
+
+def showStations(result, containerList, containerNb):
+    containerList.clear()
+    containerNb.clear()
+
+    if not result:
+        containerNb.append(0)
+        return
+
+    result = result[0]
+    for elem in result["closest_results"]:
+        containerList.append(f"'{elem['nom']}' est à {formatDistance(elem['distance'])} direction {formatDirection(elem['bearing'])} " +
+                            f"avec {elem['velos']} vélos dispos et {elem['places']} places libres")
+
+    containerNb.append(result["nb_stations"])
+
+
+def queryFailed(error, containerNb):
+    if isinstance(error, CancelledError):
+        return # a newer search replaced it
+
+    print("something went wrong...")
+    print(type(error))
+    print(error)
@@ -0,0 +1,126 @@
+from exo3.spatial import stationIndex, bearing
+from exo3.cache import resultCache
+
+
+def getClosestStations(storage, coordinates, minDistance, maxDistance, closest):
+    # coordinates : [lon, lat] ; distance in metres and bearing in degrees
+    key = resultCache.key(coordinates, minDistance, maxDistance, closest)
+    result = resultCache.get(key)
+    if result is not None:
+        return result
+
+    stamp = resultCache.stamp(stationIndex.towns(coordinates, maxDistance))
+    result = findClosestStations(storage, coordinates, minDistance, maxDistance, closest)
+    resultCache.put(key, result, stamp)
+    return result
+
+
+def findClosestStations(storage, coordinates, minDistance, maxDistance, closest):
+    if not stationIndex.warm:
+        return storage.closest(coordinates, minDistance, maxDistance, closest) # $geoNear for mongo
+
+    results, total = stationIndex.closest(coordinates, minDistance, maxDistance, closest)
+    if not total:
+        return [] # same as the aggregation, no document without stations
+
+    return [{
+        "closest_results": [{
+            "nom": station["nom"],
+            "velos": station["velos"],
+            "places": station["places"],
+            "distance": distance,
+            "bearing": direction
+        } for distance, direction, station in results],
+        "nb_stations": total
+    }]
+
+
+def getClosestStationsBatch(storage, points, minDistance, maxDistance, closest, available="velos"):
+    # points : [[lon, lat], ...] ; available : "velos" for bikes, "places" for free docks
+    # for each point, [(_id, distance in metres, bearing in degrees), ...] sorted by distance
+    if not stationIndex.warm:
+        stationIndex.load(storage)
+
+    return stationIndex.closestBatch(points, minDistance, maxDistance, closest, available)
+
+
+def geoNearStations(collection, coordinates, minDistance, maxDistance, closest):
+    # filter = {
+    #     "geometry": { 
+    #         "$near": {
+    #             "$geometry": {
+    #                 "type": 'Point',
+    #                 "coordinates": coordinates
+    #             },
+    #             "$minDistance": minDistance,
+    #             "$maxDistance": maxDistance
+    #         },
+    #     },
+    #     "nbvelosdispo": {
+    #         "$gt": 0
+    #     }
+    # }
+    projection = {
+        "_id": 0,
+        "nom": 1,
+        "velos": "$nbvelosdispo",
+        "places": "$nbplacesdispo",
+        "distance": 1,
+        "coordinates": "$geometry.coordinates"
+    }
+
+    # query = collection.find(filter, projection).limit(closest)
+
+    aggregation = [
+        {
+            "$geoNear": {
+                "near": {
+                    "type": "Point",
+                    "coordinates": coordinates
+                }, 
+                "minDistance": minDistance,
+                "maxDistance": maxDistance,
+                "distanceField": "distance"
+            }
+        },
+        {
+            "$match": {
+                "nbvelosdispo": {
+                    "$gt": 0
+                }
+            }
+        },
+        {
+            "$project": projection
+        },
+        {
+            "$facet": {
+                "closest_results": [
+                    { 
+                        "$limit": closest
+                    }
+                ],
+                "total": [
+                    {
+                        "$count": 'nb_stations'
+                    }
+                ]
+            }
+        },
+        {
+            "$unwind": "$total"
+        },
+        {
+            "$project": {
+                "closest_results": 1,
+                "nb_stations":  "$total.nb_stations"
+            }
+        }
+    ]
+
+    results = list(collection.aggregate(aggregation))
+    for result in results:
+        for station in result["closest_results"]:
+            station["bearing"] = bearing(*coordinates, *station.pop("coordinates"))
+
+    return results
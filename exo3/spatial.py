@@ -0,0 +1,180 @@
+from math import radians, degrees, sin, cos, asin, sqrt, atan2, floor, pi
+import numpy as np
+import threading
+
+
+EARTH_RADIUS = 6378100 # metres, same sphere as mongo's $geoNear
+CELL_SIZE = 0.005 # degrees, ~550 metres of latitude per grid cell
+MAX_CELLS = 400 # above this many cells a query scans every station instead
+BATCH_POINTS = 256 # query points computed together by closestBatch, close in latitude once sorted
+
+
+def bearing(lon1, lat1, lon2, lat2):
+    # degrees clockwise from the north, from point 1 towards point 2
+    lon1, lat1, lon2, lat2 = map(radians, (lon1, lat1, lon2, lat2))
+    return degrees(atan2(sin(lon2 - lon1) * cos(lat2),
+                        cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(lon2 - lon1))) % 360
+
+
+class StationIndex:
+    # grid of the live stations, kept up to date by the refresh (see exo2.add_refresh_listener)
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.stations = {} # _id => {"nom", "ville", "lon", "lat", "velos", "places", "rad": (lon, lat, cos(lat))}
+        self.cells = {} # (x, y) => [_id, ...]
+        self.ids = [] # position in the arrays => _id
+        self.positions = {} # _id => position in the arrays
+        self.arrays = {} # "lon", "lat", "cos" (radians), "velos", "places" : one value per station, sorted by latitude
+        self.warm = False
+        self.lock = threading.Lock()
+
+
+    def cell(self, lon, lat):
+        return (floor(lon / self.cell_size), floor(lat / self.cell_size))
+
+
+    def load(self, storage):
+        stations, cells = {}, {}
+        for station in storage.stations():
+            lon, lat = station["geometry"]["coordinates"]
+            stations[station["_id"]] = {
+                "nom": station["nom"],
+                "ville": station["ville"],
+                "lon": lon,
+                "lat": lat,
+                "velos": station["nbvelosdispo"],
+                "places": station["nbplacesdispo"],
+                "rad": (radians(lon), radians(lat), cos(radians(lat)))
+            }
+            cells.setdefault(self.cell(lon, lat), []).append(station["_id"])
+
+        ids = sorted(stations, key=lambda _id: stations[_id]["lat"])
+        coordinates = np.radians(np.array([[stations[_id]["lon"], stations[_id]["lat"]] for _id in ids],
+                                            dtype=float).reshape(-1, 2))
+        arrays = {
+            "lon": coordinates[:, 0],
+            "lat": coordinates[:, 1],
+            "cos": np.cos(coordinates[:, 1]),
+            "velos": np.array([stations[_id]["velos"] for _id in ids], dtype=float),
+            "places": np.array([stations[_id]["places"] for _id in ids], dtype=float)
+        }
+
+        with self.lock:
+            self.stations, self.cells = stations, cells
+            self.ids, self.positions, self.arrays = ids, {_id: i for i, _id in enumerate(ids)}, arrays
+            self.warm = True
+
+        print(f"=> Station index - {len(stations)} stations in {len(cells)} cells")
+
+
+    def update(self, town, datas):
+        # refresh listener : datas are the stations whose counts changed
+        stations = self.stations
+        for data in datas:
+            station = stations.get(data["_id"])
+            if station:
+                station["velos"], station["places"] = data["nbvelosdispo"], data["nbplacesdispo"]
+                position = self.positions[data["_id"]]
+                self.arrays["velos"][position], self.arrays["places"][position] = station["velos"], station["places"]
+
+
+    def candidates(self, lon, lat, maxDistance):
+        dlat = degrees(maxDistance / EARTH_RADIUS)
+        dlon = dlat / max(cos(radians(lat)), 1e-6)
+        (x_min, y_min), (x_max, y_max) = self.cell(lon - dlon, lat - dlat), self.cell(lon + dlon, lat + dlat)
+
+        if (x_max - x_min + 1) * (y_max - y_min + 1) > MAX_CELLS:
+            return self.stations.keys()
+
+        return [_id for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)
+                for _id in self.cells.get((x, y), ())]
+
+
+    def towns(self, coordinates, maxDistance):
+        # towns a query around coordinates can see, None while the index is cold
+        if not self.warm:
+            return None
+
+        lon, lat = coordinates
+        with self.lock:
+            return {self.stations[_id]["ville"] for _id in self.candidates(lon, lat, maxDistance)}
+
+
+    def closest(self, coordinates, minDistance, maxDistance, closest):
+        # coordinates : [lon, lat] ; stations with bikes sorted by distance, and how many there are in range
+        lon, lat = coordinates
+        lon_rad, lat_rad = radians(lon), radians(lat)
+        cos_lat = cos(lat_rad)
+        # haversine compared on its inner term, asin is only applied to the kept stations
+        low, high = (sin(min(distance / (2 * EARTH_RADIUS), pi / 2)) ** 2 for distance in (minDistance, maxDistance))
+
+        with self.lock:
+            stations = self.stations
+            found = []
+            for _id in self.candidates(lon, lat, maxDistance):
+                station = stations[_id]
+                if station["velos"] <= 0:
+                    continue
+
+                s_lon, s_lat, s_cos = station["rad"]
+                a = sin((s_lat - lat_rad) / 2) ** 2 + cos_lat * s_cos * sin((s_lon - lon_rad) / 2) ** 2
+                if low <= a <= high:
+                    found.append((a, _id))
+
+        found.sort()
+        return [(2 * EARTH_RADIUS * asin(sqrt(a)),
+                bearing(lon, lat, stations[_id]["lon"], stations[_id]["lat"]),
+                stations[_id]) for a, _id in found[:closest]], len(found)
+
+
+    def closestBatch(self, points, minDistance, maxDistance, closest, available="velos"):
+        # points : [[lon, lat], ...] ; available : "velos" for bikes, "places" for free docks
+        # for each point, [(_id, distance in metres, bearing in degrees), ...] sorted by distance
+        points = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+        with self.lock:
+            ids, arrays = self.ids, self.arrays
+
+        results = [[] for _ in points]
+        if not ids:
+            return results
+
+        low, high = (np.sin(min(distance / (2 * EARTH_RADIUS), pi / 2)) ** 2 for distance in (minDistance, maxDistance))
+        band = maxDistance / EARTH_RADIUS # radians of latitude around a point holding every candidate
+        order = np.argsort(points[:, 1])
+
+        for begin in range(0, len(order), BATCH_POINTS):
+            rows = order[begin:begin+BATCH_POINTS]
+            lon, lat = points[rows, :1], points[rows, 1:]
+
+            first, last = np.searchsorted(arrays["lat"], [lat.min() - band, lat.max() + band])
+            if first == last:
+                continue
+            s_lon, s_lat, s_cos = arrays["lon"][first:last], arrays["lat"][first:last], arrays["cos"][first:last]
+
+            # haversine compared on its inner term, like closest
+            a = np.sin((s_lat - lat) / 2) ** 2 + np.cos(lat) * s_cos * np.sin((s_lon - lon) / 2) ** 2
+            a[(a < low) | (a > high) | ~(arrays[available][first:last] > 0)] = np.inf
+
+            k = min(closest, last - first)
+            nearest = np.argpartition(a, k - 1, axis=1)[:, :k]
+            lines = np.arange(len(rows))[:, None]
+            nearest = nearest[lines, np.argsort(a[lines, nearest], axis=1)]
+            kept = a[lines, nearest]
+
+            distances = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.where(np.isinf(kept), 0, kept)))
+            d_lon = s_lon[nearest] - lon
+            bearings = np.degrees(np.arctan2(np.sin(d_lon) * np.cos(s_lat[nearest]),
+                                            np.cos(lat) * np.sin(s_lat[nearest]) -
+                                            np.sin(lat) * np.cos(s_lat[nearest]) * np.cos(d_lon))) % 360
+
+            for line, row in enumerate(rows):
+                results[row] = [(ids[first + position], float(distance), float(direction))
+                                for position, distance, direction, inner
+                                in zip(nearest[line], distances[line], bearings[line], kept[line])
+                                if inner != np.inf]
+
+        return results
+
+
+stationIndex = StationIndex()
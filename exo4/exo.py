@@ -1,49 +1,52 @@
 from guizero import App, Box, TextBox, ListBox, Text, PushButton, Picture, Combo
 from tkinter import Scrollbar, Spinbox, DoubleVar
-import pandas as pd
 import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon
-from matplotlib.colors import ListedColormap
 import json
-import os
+from concurrent.futures import CancelledError
 
-from utils.utils import listFiles, readJson, dumpGraph
-from exo4.exo4_1.exo import searchByTownAndStation, getTowns
-from exo4.exo4_2.exo import updateStation
-from exo4.exo4_3.exo import deleteStation
-from exo4.exo4_4.exo import flipStations, getCoordsByTown, searchByPolygon
-from exo4.exo4_5.exo import searchByStats
+from utils.utils import listFiles, readJson
+from exo4.exo4_4.exo import polygons
+from exo4.exo4_5.exo import localDate, TIMEZONE
+from exo4.pager import Pager
+from exo4.render import MapRenderer, DISPLAY_HEIGHT
+from exo4.mapstate import MapState
+from utils.executor import QueryExecutor
+
+
+AUTOCOMPLETE_MIN = 2 # characters typed before names are suggested
 
 
 class exo4:
-    def __init__(self, collection_live, collection_history, *_):
+    def __init__(self, storage, *_):
+        # searches, pages, edits and deletes go through storage, see storage.base
         plt.switch_backend('agg') # able to end prgm when close windows
 
-        self.collection_live = collection_live
-        self.collection_history = collection_history
-        self.resultList = []
+        self.storage = storage
+        self.resultList = [] # stations of the visible page
+        self.pager = None
+        self.pageNumber = 0
+        self.pageText = None
         self.resultContainer = None
         self.resultButtons = []
         self.updatePanel = None
         self.updateInputs = None
         self.updateButton = None
         self.currentFrame = None
-        self.tmpDir = "tmp"
-        self.baseGraphs = []
-        self.graphs = []
+        self.mapState = MapState()
+        self.townNames = [] # map index => ville
+        self.renderers = []
         self.pictures = []
         self.boundingBoxes = []
         self.polygon = None
         self.mapBtn = None
         self.nbResult = None
         self.sort = None
-
-        if not os.path.exists(self.tmpDir):
-            os.mkdir(self.tmpDir)
+        self.executor = QueryExecutor() # storage queries and map renders run off the Tk thread
 
         try:
             app = App(title="Business program", height="600", width="800")
             app.tk.resizable(False, False)  # everything will be absolutely relative
+            self.executor.start(app)
 
             self.createLeftScreen(app)
             Box(app, height="fill", align="left", border=True)
@@ -52,12 +55,8 @@ class exo4:
             app.display()
         except Exception as e:
             print(e)
-
-
-    def __del__(self):
-        for file in listFiles(self.tmpDir):
-            os.remove(file)
-        os.removedirs(self.tmpDir)
+        finally:
+            self.executor.shutdown()
 
 
     def resultContainerSelection(self):
@@ -71,9 +70,6 @@ class exo4:
         for btn in self.resultButtons:
             btn.enable()
 
-        if len(self.resultContainer.value) > 1:
-            self.resultButtons[0].disable()
-
 
     def createLeftScreen(self, container):
         resultBox = Box(container, height="fill", width=int(container.width/3), align="left")
@@ -91,6 +87,11 @@ class exo4:
 
         menu_box = Box(resultBox, align="bottom", layout="grid")
 
+        pages = Box(resultBox, align="bottom", layout="grid")
+        PushButton(pages, grid=[0,0], width=2, pady=2, text="<", command=self.leftScreen_page, args=(-1,))
+        self.pageText = Text(pages, grid=[1,0], text="page 1 / 1")
+        PushButton(pages, grid=[2,0], width=2, pady=2, text=">", command=self.leftScreen_page, args=(1,))
+
         scrollbar = Scrollbar(resultBox.tk, orient="horizontal")
         scrollbar.pack(side="bottom", fill="both")
         listBox = self.resultContainer.children[0].tk
@@ -101,7 +102,7 @@ class exo4:
             {
                 "name": "Sélectionner tout",
                 "command": self.leftScreen_selection,
-                "args": (lambda: listBox.select_set(0, "end"), lambda: self.resultButtons[1:], lambda btn: btn.enable()),
+                "args": (lambda: listBox.select_set(0, "end"), lambda: self.resultButtons, lambda btn: btn.enable()),
                 "grid": [0,0]
             },
             {
@@ -148,10 +149,17 @@ class exo4:
 
 
     def leftScreen_sort(self, combo):
-        if not combo or not len(self.resultList):
+        if not self.pager:
             return
 
-        self.insertResult(None, sorted(self.resultList, key=lambda k: k[combo.lower()]))
+        self.insertResult(None, self.pager.sorted(combo)) # server side, see exo4.pager.SORTS
+
+
+    def leftScreen_page(self, step):
+        if not self.pager:
+            return
+
+        self.showPage(self.pageNumber + step) # kept in range by fetchPage
 
 
     def leftScreen_selection(self, lambdaList, lambdaSelect, lambdaBtns):
@@ -160,44 +168,56 @@ class exo4:
         for btn in lambdaSelect():
             lambdaBtns(btn)
 
-        if self.resultContainer.value and len(self.resultContainer.value) == 1:
-            self.resultButtons[0].enable()
-
 
     def leftScreen_update(self):
-        index = [i for i, entity in enumerate(self.resultList)
-                if self.resultContainer.value[0] == f"{entity['ville']} ; {entity['nom']}"][0]
+        indexes = [i for i, entity in enumerate(self.resultList)
+                    if f"{entity['ville']} ; {entity['nom']}" in self.resultContainer.value]
 
-        entity = self.resultList[index]
+        ids = [self.resultList[index]["_id"] for index in indexes]
+        entities = self.storage.find(ids) # page only holds the listed fields
+        if not entities:
+            self.updatePanel.hide()
+            print("=> selected stations no longer exist")
+            return
+        single = len(entities) == 1
+
+        for child in list(self.updateInputs.children):
+            child.destroy()
 
         inputs = {}
         texts = {}
+        shown = {} # values displayed, unchanged ones are not sent
         i = 0
-        for (key, value) in entity.items():
-            if key in ["_id", "geometry", "actif", "nbvelosdispo", "nbplacesdispo"]:
+        for (key, value) in entities[0].items():
+            if key in ["_id", "geometry", "actif", "nbvelosdispo", "nbplacesdispo", "nom_normalise", "nom_ngrams",
+                        "version", "updated_at", "edits"] or (key == "nom" and not single):
                 continue
 
+            shown[key] = str(value) if single else "" # several stations : only filled fields are applied to all
             texts[key] = Text(self.updateInputs, grid=[0,i], text=key.title())
             Text(self.updateInputs, grid=[1,i])  # margin
-            inputs[key] = TextBox(self.updateInputs, grid=[2,i], width="25", text=value)
+            inputs[key] = TextBox(self.updateInputs, grid=[2,i], width="25", text=shown[key])
             i += 1
 
             Box(self.updateInputs, grid=[0,i], height="5")  # margin
             i += 1
 
-        texts["nbplacestotal"].clear()
-        texts["nbplacestotal"].append("Emplacements totaux")
+        if "nbplacestotal" in texts:
+            texts["nbplacestotal"].clear()
+            texts["nbplacestotal"].append("Emplacements totaux")
 
-        for (key, value) in zip(["latitude", "longitude"], entity["geometry"]["coordinates"]):
-            Text(self.updateInputs, grid=[0,i], text=key.title())
-            Text(self.updateInputs, grid=[1,i])  # margin
-            inputs[key] = TextBox(self.updateInputs, grid=[2,i], width="25", text=value)
-            i += 1
+        if single:
+            for (key, value) in zip(["longitude", "latitude"], entities[0]["geometry"]["coordinates"]):
+                shown[key] = str(value)
+                Text(self.updateInputs, grid=[0,i], text=key.title())
+                Text(self.updateInputs, grid=[1,i])  # margin
+                inputs[key] = TextBox(self.updateInputs, grid=[2,i], width="25", text=value)
+                i += 1
 
-            Box(self.updateInputs, grid=[0,i], height="5")  # margin
-            i += 1
+                Box(self.updateInputs, grid=[0,i], height="5")  # margin
+                i += 1
 
-        self.updateButton.update_command(command=self.updateFields, args=(index, entity, inputs))
+        self.updateButton.update_command(command=self.updateFields, args=(indexes, entities, inputs, shown))
         
         self.updatePanel.show()
 
@@ -208,17 +228,13 @@ class exo4:
         indexes = [i for i, entity in enumerate(self.resultList)
                     if f"{entity['ville']} ; {entity['nom']}" in self.resultContainer.value]
 
-        to_remove = []
-        for index in indexes[::-1]: # reverse
-            to_remove.append(self.resultList[index]["_id"])
-            del self.resultList[index]
+        to_remove = [self.resultList[index]["_id"] for index in indexes]
 
-        self.resultContainer.clear()
-        for item in self.resultList:
-            self.resultContainer.append(f"{item['ville']} ; {item['nom']}")
+        self.storage.delete_stations(to_remove)
+        self.updateMaps(self.mapState.remove(to_remove))
 
-        deleteStation(self.collection_live, self.collection_history, to_remove)
-        self.updateMaps()
+        # a new pager : a worker may still be reading the current one, and no cached page or query is reused
+        self.loadPage(self.pager.sorted(self.pager.sort), self.pageNumber, shared=False)
 
 
     def leftScreen_flip(self, state):
@@ -228,9 +244,10 @@ class exo4:
                     if f"{entity['ville']} ; {entity['nom']}" in self.resultContainer.value]
         dbIndexes = [self.resultList[index]["_id"] for index in indexes]
 
-        flipStations(self.collection_live, dbIndexes, state)
-        self.updateMaps()
+        self.storage.flip_stations(dbIndexes, state)
+        self.updateMaps(self.mapState.flip(dbIndexes, state))
         for index in indexes:
+            self.resultList[index]["actif"] = state
             self.flipDisplayState(index, state)
 
 
@@ -283,13 +300,16 @@ class exo4:
         Text(inputsContainer, grid=[0,0], text="Ville")
         Text(inputsContainer, grid=[1,0])  # margin
         townField = Combo(inputsContainer, grid=[2,0], width="19",
-                            options=["Tous"]+[line["_id"] for line in getTowns(self.collection_live)])
+                            options=["Tous"]+self.storage.towns())
 
         Box(inputsContainer, grid=[0,1], height="5")  # margin
 
         Text(inputsContainer, grid=[0,2], text="Nom de station")
         Text(inputsContainer, grid=[1,2])  # margin
         nameField = TextBox(inputsContainer, grid=[2,2], width="25")
+        suggestions = ListBox(inputsContainer, grid=[2,3], width=200, height=70, scrollbar=True, visible=False,
+                                command=lambda name: self.pickSuggestion(nameField, suggestions, name))
+        nameField.update_command(lambda: self.autocomplete(townField, nameField, suggestions))
 
         Box(container, height="40")  # margin
 
@@ -297,6 +317,30 @@ class exo4:
         btn.update_command(self.updateResult_form, args=(btn, townField, nameField))
 
 
+    def autocomplete(self, town, station, suggestions):
+        if len(station.value.strip()) < AUTOCOMPLETE_MIN:
+            suggestions.clear()
+            suggestions.hide()
+            return
+
+        args = (town.value, station.value)
+        self.executor.submit("autocomplete", ("autocomplete", *args), self.storage.autocomplete, args,
+                            lambda stations: self.showSuggestions(suggestions, stations), self.queryFailed)
+
+
+    def showSuggestions(self, suggestions, stations):
+        suggestions.clear()
+        for name in dict.fromkeys(station["nom"] for station in stations): # same name in several towns : once
+            suggestions.append(name)
+        suggestions.visible = bool(stations)
+
+
+    def pickSuggestion(self, station, suggestions, name):
+        station.value = name
+        suggestions.clear()
+        suggestions.hide()
+
+
     def upperRight_map(self, container):
         Box(container, height="10")  # margin
         Text(container, align="top", text="Sélection polygonale")
@@ -324,21 +368,14 @@ class exo4:
 
             mapBox = readJson(f"apis/{name.lower()}.json")["visual"]["boundingBox"]
 
-            fig = plt.figure()
-            ax = fig.gca()
-            ax.grid(True)
-            ax.imshow(plt.imread(file), extent=mapBox, zorder=0, aspect='equal')
-            ax.set_xlim(mapBox[0], mapBox[1])
-            ax.set_ylim(mapBox[2], mapBox[3])
-
-            fig.savefig(f"{self.tmpDir}/{i}.png")
-            self.baseGraphs.append(fig)
-            self.graphs.append(fig)
+            self.townNames.append(name)
+            self.renderers.append(MapRenderer(plt.imread(file), mapBox))
             self.boundingBoxes.append([])
 
-            self.pictures.append(Picture(container, image=f"{self.tmpDir}/{i}.png", height=350, align="top"))
+            self.pictures.append(Picture(container, image=self.renderers[-1].render(), height=DISPLAY_HEIGHT, align="top"))
             self.pictures[-1].hide()
 
+        self.mapState.load(self.storage)
         self.updateMaps()
 
 
@@ -353,40 +390,39 @@ class exo4:
         buttons[i].text = buttons[i].text.upper()
 
 
-    def updateMaps(self):
-        for i, line in enumerate(getCoordsByTown(self.collection_live)):
-            df = pd.DataFrame([line for line in line["coords"]], columns=["lat", "lon", "actif"])
+    def updateMaps(self, towns=None):
+        # towns : only re-render these maps, all of them when None
+        for i, town in enumerate(self.townNames):
+            if towns is not None and town not in towns:
+                continue
 
-            padding = 0.001 # overflow approx
-            self.boundingBoxes[i] = (round(df.lon.min()-padding, 4),
-                                    round(df.lon.max()+padding, 4),
-                                    round(df.lat.min()-padding, 4),
-                                    round(df.lat.max()+padding, 4))
+            self.boundingBoxes[i] = self.mapState.get(town).boundingBox() or self.boundingBoxes[i]
+            self.renderMap(i)
 
-            newfig = dumpGraph(self.baseGraphs[i])
-            newfig.gca().scatter(df.lon, df.lat, zorder=3, s=10, c=df.actif,
-                                cmap=ListedColormap(["darkolivegreen"] if len(df.actif.unique()) == 1 else ["r", "darkolivegreen"]))
-            newfig.savefig(f"{self.tmpDir}/{i}.png")
 
-            self.graphs[i]= newfig
-            self.pictures[i].value = f"{self.tmpDir}/{i}.png"
+    def renderMap(self, index):
+        # every layer is sent, a render superseded before it ran loses nothing
+        stations = self.mapState.get(self.townNames[index])
+        layers = ((stations.lat.copy(), stations.lon.copy(), stations.actif.copy()), # latitude on x
+                    self.polygon if index == self.currentFrame else None)
+
+        self.executor.submit(f"map {index}", None, self.renderers[index].update, layers,
+                            lambda image: setattr(self.pictures[index], "value", image), self.queryFailed)
 
 
     def draw_polygon(self, field):
         if not field.value:
             return
 
-        self.polygon = json.loads(field.value)
-
-        index = self.currentFrame
-        newfig = dumpGraph(self.graphs[index])
-        ax = newfig.gca()
-        ax.add_patch(Polygon(self.polygon, zorder=1, alpha=0.2, color="cornflowerblue"))
-        ax.add_patch(Polygon(self.polygon, zorder=2, linestyle='solid', fill=False, color="blue"))
-        ax.scatter([x for x, _ in self.polygon], [y for _, y in self.polygon], c="blue", marker="x")
-        newfig.savefig(f"{self.tmpDir}/{index}.png")
+        try:
+            self.polygon = polygons(json.loads(field.value)) # rings, holes and multi-polygons alike
+        except ValueError as e: # bad json or structure
+            print("something went wrong...")
+            print(type(e))
+            print(e)
+            return
 
-        self.pictures[index].value = f"{self.tmpDir}/{index}.png"
+        self.renderMap(self.currentFrame)
         self.mapBtn.enable()
 
 
@@ -394,11 +430,7 @@ class exo4:
         self.mapBtn.disable()
         self.polygon = None
 
-        index = self.currentFrame
-        fig = self.graphs[index]
-        fig.savefig(f"{self.tmpDir}/{index}.png")
-
-        self.pictures[index].value = f"{self.tmpDir}/{index}.png"
+        self.renderMap(self.currentFrame)
 
 
     def upperRight_stats(self, container):
@@ -438,24 +470,46 @@ class exo4:
         Text(inputsContainer, grid=[3,0], text=" au ")
         end_week = Combo(inputsContainer, grid=[4,0], width=8, options=days, selected="Vendredi")
 
+        Box(container, height="15")  # margin
+
+        inputsContainer = Box(container, layout="grid")
+        Text(inputsContainer, grid=[1,0], text="Entre le ")
+        begin_date = TextBox(inputsContainer, grid=[2,0], width=10)
+        Text(inputsContainer, grid=[3,0], text=" et le ")
+        end_date = TextBox(inputsContainer, grid=[4,0], width=10)
+        Text(inputsContainer, grid=[5,0], text=" (AAAA-MM-JJ)")
+
+        Box(container, height="15")  # margin
+
+        inputsContainer = Box(container, layout="grid")
+        Text(inputsContainer, grid=[1,0], text="Fuseau horaire ")
+        timezone = Combo(inputsContainer, grid=[2,0], width=12, options=[TIMEZONE, "UTC"], selected=TIMEZONE)
+
         Box(container, height="25")  # margin
 
-        args = (compare, ratio, begin_hour, end_hour, days, begin_week, end_week)
+        args = (compare, ratio, begin_hour, end_hour, days, begin_week, end_week, begin_date, end_date, timezone)
         btn = PushButton(container, width="10", text="Rechercher")
         btn.update_command(self.updateResult_stats, args=(btn, *args))
 
 
     def updateResult_form(self, btn, town, station):
         self.sort.select_default()
-        self.insertResult(btn, searchByTownAndStation(self.collection_live, town.value, station.value))
+        self.insertResult(btn, Pager(self.storage.search_query(town.value, station.value)))
 
 
     def updateResult_polygon(self, btn):
         self.sort.select_default()
-        self.insertResult(btn, searchByPolygon(self.collection_live, [[lat, lon] for (lon, lat) in self.polygon]))
+        polygon = [[[[lon, lat] for lat, lon in ring] for ring in shape] for shape in self.polygon] # maps show latitude on x
 
+        if self.mapState.towns:
+            query = self.storage.ids_query(self.mapState.within(polygon))
+        else:
+            query = self.storage.within_query(polygon)
+        self.insertResult(btn, Pager(query))
 
-    def updateResult_stats(self, btn, compare, ratio, begin_hour, end_hour, week, begin_week, end_week):
+
+    def updateResult_stats(self, btn, compare, ratio, begin_hour, end_hour, week, begin_week, end_week,
+                            begin_date, end_date, timezone):
         self.sort.select_default()
         compare_map = {
             ">": "$gt",
@@ -468,31 +522,65 @@ class exo4:
             args = (compare_map[compare.value], ratio.get(),
                     int(begin_hour.value), int(end_hour.value),
                     week.index(begin_week.value) + 1, week.index(end_week.value) + 1)
-            self.insertResult(btn, searchByStats(self.collection_history, *args))
+            window = {
+                "begin_date": localDate(begin_date.value, timezone.value),
+                "end_date": localDate(end_date.value, timezone.value, days=1), # whole last day
+                "timezone": timezone.value
+            }
+            self.insertResult(btn, Pager(self.storage.stats_query(*args, **window)))
         except Exception as e:
             print(e)
 
 
-    def insertResult(self, btn, datas):
+    def insertResult(self, btn, pager):
         if btn:
             btn.disable()
+
+        self.loadPage(pager, 0, btn)
+
+
+    def showPage(self, number):
+        self.loadPage(self.pager, number)
+
+
+    def loadPage(self, pager, number, btn=None, shared=True):
+        key = (*pager.query.key, pager.sort, number) if shared else None
+        self.executor.submit("results", key, fetchPage, (pager, number),
+                            lambda result: self.displayPage(*result, btn), lambda error: self.queryFailed(error, btn))
+
+
+    def displayPage(self, pager, number, stations, btn):
         self.updatePanel.hide()
         self.resultContainer.clear()
-        self.resultList = []
 
-        datas = list(datas)
+        self.pager = pager
         self.nbResult.clear()
-        self.nbResult.append(len(datas))
+        self.nbResult.append(pager.count()) # counted by fetchPage
 
-        for i, item in enumerate(datas):
+        self.pageNumber = number
+        self.resultList = stations
+        self.pageText.value = f"page {number + 1} / {pager.nb_pages()}"
+
+        for i, item in enumerate(self.resultList):
             self.resultContainer.append(f"{item['ville']} ; {item['nom']}")
-            self.resultList.append(item)
             self.flipDisplayState(i, item["actif"])
 
         if btn:
             btn.enable()
 
 
+    def queryFailed(self, error, btn=None):
+        if btn:
+            btn.enable()
+
+        if isinstance(error, CancelledError):
+            return # a newer request replaced it
+
+        print("something went wrong...")
+        print(type(error))
+        print(error)
+
+
     def flipDisplayState(self, index, state):
         self.resultContainer.children[0].tk.itemconfig(index, { "bg":("white" if state else "lightgrey") })
 
@@ -503,7 +591,7 @@ class exo4:
 
         Box(updateBox, height="10")  # margin
 
-        Text(updateBox, text="Modification des données d'une station")
+        Text(updateBox, text="Modification des données des stations")
 
         Box(updateBox, height="10")  # margin
 
@@ -519,29 +607,49 @@ class exo4:
         self.updatePanel.hide()
 
     
-    def updateFields(self, index, entity, inputs):
+    def updateFields(self, indexes, entities, inputs, shown):
         intFields = ["nbplacestotal"]
-        for key, value in inputs.items():            
-            if key in ["longitude", "latitude"]:
-                continue
+        floatFields = ["longitude", "latitude"]
+        patch = {}
+        for key, value in inputs.items():
+            if not value.value or value.value == shown[key]:
+                continue # no modif
 
             try:
-                entity[key] = int(value.value) if key in intFields else value.value
-            except:
+                patch[key] = int(value.value) if key in intFields else float(value.value) if key in floatFields else value.value
+            except ValueError:
                 pass # no modif
 
-        try:
-            entity["geometry"]["coordinates"] = [int(inputs["latitude"].value), int(inputs["longitude"].value)]
-        except:
-            pass # no modif
+        if "longitude" in patch or "latitude" in patch:
+            lon, lat = entities[0]["geometry"]["coordinates"]
+            patch["geometry"] = {
+                "type": "Point",
+                "coordinates": [patch.pop("longitude", lon), patch.pop("latitude", lat)]
+            }
 
-        self.resultList[index] = entity
+        edits = [(entity["_id"], entity.get("version", 0), patch) for entity in entities]
+        rejected = self.storage.update_stations(edits)
+        if rejected:
+            print(f"=> {len(rejected)} stations were changed meanwhile, select them again to edit them")
 
-        self.resultContainer.clear()
-        for item in self.resultList:
-            self.resultContainer.append(f"{item['ville']} ; {item['nom']}")
+        applied = {entity["_id"] for entity in entities} - set(rejected) # deleted meanwhile : not in entities
+        towns = set()
+        for index in indexes:
+            station = self.resultList[index]
+            if station["_id"] not in applied:
+                continue
 
-        updateStation(self.collection_live, entity)
-        self.updateMaps()
+            station.update({key: patch[key] for key in ["ville", "nom"] if key in patch})
+            if "geometry" in patch:
+                towns |= self.mapState.move(station["_id"], *patch["geometry"]["coordinates"])
 
-        self.updatePanel.hide()
+        if towns:
+            self.updateMaps(towns)
+
+        self.showPage(self.pageNumber)
+
+
+def fetchPage(pager, number):
+    # run by the executor : counts, then reads the page, number kept in range
+    number = min(max(number, 0), pager.nb_pages() - 1)
+    return pager, number, pager.page(number)
@@ -1,28 +1,64 @@
+import re
+
+from utils.utils import normalize, ngrams, NGRAM
 
-def searchByTownAndStation(collection, town, station):
-    stationFilter = {}
-    if station:
-        stationFilter = {
-            "nom": {
-                "$regex": station,
-                "$options": "i"
-            }
-        }
 
+AUTOCOMPLETE_LIMIT = 10
+
+
+def stationFilter(town, station, prefix=False):
+    # town : exact value or "Tous" ; station : substring of the name, or its beginning when prefix
     townFilter = {}
     if town != "Tous":
         townFilter = {
-            "$text": {
-                "$search": town
-            }
+            "ville": town
         }
 
-    filter = {
+    stationFilter = {}
+    if station:
+        text = normalize(station)
+        pattern = re.escape(text)
+
+        if prefix:
+            stationFilter = {
+                "nom_normalise": {
+                    "$regex": f"^{pattern}" # anchored, bounded scan of the index
+                }
+            }
+        elif len(text) >= NGRAM:
+            stationFilter = {
+                "nom_ngrams": {
+                    "$all": ngrams(text)
+                },
+                "nom_normalise": {
+                    "$regex": pattern # drops names holding every ngram but not the substring
+                }
+            }
+        else:
+            stationFilter = {
+                "nom_normalise": {
+                    "$regex": pattern # too short for ngrams, scans the index only
+                }
+            }
+
+    return {
         **stationFilter,
         **townFilter
     }
 
-    return collection.find(filter)
+
+def searchByTownAndStation(collection, town, station, prefix=False, projection=None):
+    return collection.find(stationFilter(town, station, prefix), projection)
+
+
+def autocompleteStation(collection, town, text, limit=AUTOCOMPLETE_LIMIT):
+    projection = {
+        "_id": 0,
+        "nom": 1,
+        "ville": 1
+    }
+
+    return collection.find(stationFilter(town, text, prefix=True), projection).sort("nom_normalise", 1).limit(limit)
 
 
 def getTowns(collection):
@@ -1,13 +1,61 @@
+from pymongo import UpdateOne
+from bson import ObjectId
 
-def updateStation(collection, object):
-    match = {
-        "_id": object["_id"]
-    }
-    query = {
-        "$set": {
-            **object,
-        }
+from utils.utils import nameFields
+
+
+EDIT_TOKENS = 16 # last edits remembered per station, to tell which guarded updates were applied
+PROTECTED = ["_id", "version", "updated_at", "edits", # concurrency guard
+            "nbvelosdispo", "nbplacesdispo", # written by the refresh
+            "nom_normalise", "nom_ngrams"] # derived from nom
+
+
+def versionGuard(_id, version):
+    # stations inserted before the version field match as version 0
+    return {
+        "_id": _id,
+        "version": version if version else {"$in": [0, None]}
     }
 
-    result = collection.update_one(match, query)
-    print(f"=> updated {result.modified_count}/{result.matched_count} lines")
+
+def stationPatch(patch):
+    patch = {key: value for key, value in patch.items() if key not in PROTECTED}
+    if "nom" in patch:
+        patch.update(nameFields(patch["nom"]))
+    return patch
+
+
+def updateStations(collection, edits):
+    # edits : [(_id, version read, {field: value})], sent in one bulk_write
+    # an edit whose station changed since it was read is rejected, returns the rejected _ids
+    token = ObjectId() # pushed by every update of this call, found back on the stations it changed
+    operations, ids = [], []
+    for _id, version, patch in edits:
+        patch = stationPatch(patch)
+        if not patch:
+            continue
+
+        operations.append(UpdateOne(versionGuard(_id, version), {
+            "$set": patch,
+            "$inc": {"version": 1},
+            "$currentDate": {"updated_at": True},
+            "$push": {"edits": {"$each": [token], "$slice": -EDIT_TOKENS}}
+        }))
+        ids.append(_id)
+
+    if not operations:
+        return []
+
+    result = collection.bulk_write(operations, ordered=False)
+    rejected = []
+    if result.matched_count < len(operations):
+        # only on conflict : the token tells the applied updates apart, whatever was written since
+        applied = {station["_id"] for station in collection.find({"_id": {"$in": ids}, "edits": token}, {"_id": 1})}
+        rejected = [_id for _id in ids if _id not in applied]
+
+    print(f"=> updated {result.modified_count}/{result.matched_count}/{len(operations)} lines, {len(rejected)} stale edits rejected")
+    return rejected
+
+
+def updateStation(collection, object):
+    return updateStations(collection, [(object["_id"], object.get("version", 0), object)])
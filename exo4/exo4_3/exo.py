@@ -1,3 +1,5 @@
+from exo2.purge import enqueue_purge
+
 
 def deleteStation(collection_live, collection_history, objectIds):
     match = {
@@ -7,5 +9,5 @@ def deleteStation(collection_live, collection_history, objectIds):
     }
 
     result_live = collection_live.delete_many(match)
-    result_history = collection_history.delete_many(match)
-    print(f"=> All selected stations erased : {result_live.acknowledged and result_history.acknowledged}")
+    job = enqueue_purge(collection_history, objectIds) # history is keyed by station_id, purged in background
+    print(f"=> All selected stations erased : {result_live.acknowledged}, history purge queued ({job})")
@@ -1,3 +1,5 @@
+import numpy as np
+
 
 def flipStations(collection, objectIds, state):
     match = {
@@ -8,6 +10,12 @@ def flipStations(collection, objectIds, state):
     query = {
         "$set" : {
             "actif": state,
+        },
+        "$inc": {
+            "version": 1
+        },
+        "$currentDate": {
+            "updated_at": True
         }
     }
 
@@ -15,23 +23,78 @@ def flipStations(collection, objectIds, state):
     print(f"=> updated {result.modified_count}/{result.matched_count}/{len(objectIds)} lines")
 
 
-def searchByPolygon(collection, polygon):
-    filter = {
+def polygons(polygon):
+    # a ring, a polygon (outer ring then holes) or a list of polygons => list of polygons, points as [lon, lat]
+    depth, item = 0, polygon
+    while type(item) in (list, tuple):
+        depth, item = depth + 1, item[0]
+
+    if depth not in (2, 3, 4):
+        raise ValueError(f"bad polygon structure : {polygon}")
+
+    shapes = [[polygon]] if depth == 2 else [polygon] if depth == 3 else polygon
+    for shape in shapes:
+        for ring in shape:
+            if len({tuple(point) for point in ring}) < 3:
+                raise ValueError(f"a ring needs at least 3 distinct points : {ring}")
+    return shapes
+
+
+def closed(ring):
+    return list(ring) if list(ring[0]) == list(ring[-1]) else list(ring) + [ring[0]]
+
+
+def polygonFilter(polygon):
+    shapes = [[closed(ring) for ring in shape] for shape in polygons(polygon)]
+    return {
         "geometry": {
             "$geoWithin": {
-                "$polygon": polygon
+                "$geometry": {
+                    "type": "Polygon",
+                    "coordinates": shapes[0]
+                } if len(shapes) == 1 else {
+                    "type": "MultiPolygon",
+                    "coordinates": shapes
+                }
             }
         }
     }
 
-    return collection.find(filter)
+
+def searchByPolygon(collection, polygon, projection=None):
+    return collection.find(polygonFilter(polygon), projection)
+
+
+def pointsInPolygon(lon, lat, polygon):
+    # mask of the points inside, even-odd rule : holes are left out, polygons are merged
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    mask = np.zeros(len(lon), dtype=bool)
+
+    for shape in polygons(polygon):
+        outer = np.asarray(shape[0], dtype=float)
+        candidates = np.flatnonzero((lon >= outer[:, 0].min()) & (lon <= outer[:, 0].max()) &
+                                    (lat >= outer[:, 1].min()) & (lat <= outer[:, 1].max()))
+        x, y = lon[candidates], lat[candidates]
+
+        inside = np.zeros(len(candidates), dtype=bool)
+        for ring in shape:
+            ring = np.asarray(ring, dtype=float)
+            for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)): # one edge at a time, every point at once
+                if y1 == y2:
+                    continue # horizontal edges are never crossed
+                crossing = (y1 > y) != (y2 > y)
+                inside ^= crossing & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+
+        mask[candidates] |= inside
+
+    return mask
 
 
 def getCoordsByTown(collection):
+    # per town : station ids and their [lon, lat, actif], in the same order
     aggregation = [
         {
             "$project": {
-                "_id": 0,
                 "ville": 1,
                 "coords": [
                     {
@@ -47,6 +110,9 @@ def getCoordsByTown(collection):
         {
             "$group": {
                 "_id": "$ville",
+                "ids": {
+                    "$push": "$_id"
+                },
                 "coords": {
                     "$push": "$coords"
                 }
@@ -56,6 +122,7 @@ def getCoordsByTown(collection):
             "$project": {
                 "_id": 0,
                 "ville": "$_id",
+                "ids": 1,
                 "coords": 1
             }
         },
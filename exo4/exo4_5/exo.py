@@ -1,44 +1,147 @@
-def searchByStats(collection_history, compare, ratio, begin_hour, end_hour, begin_week, end_week):
-    days_range = list(range(begin_week, end_week + 1))
-    hour_range = list(range(begin_hour, end_hour + 1))
+from datetime import datetime, timedelta, timezone as tz
+from zoneinfo import ZoneInfo
+
+from exo2.history import TIMEZONE, bucket_start, rollups
+
 
-    aggregation = [
+def localDate(text, timezone, days=0):
+    # "YYYY-MM-DD" midnight in timezone, shifted by days => naive utc datetime, None when empty
+    if not text:
+        return None
+
+    day = datetime.strptime(text, "%Y-%m-%d") + timedelta(days=days)
+    return day.replace(tzinfo=ZoneInfo(timezone)).astimezone(tz.utc).replace(tzinfo=None)
+
+
+def rollupStages(days_range, hour_range):
+    # running sums per station / local weekday / hour maintained by the refresh, see exo2.history
+    return [
         {
-            "$group": {
-                "_id": {
-                    "station": "$station_id",
+            "$match": {
+                "dayOfWeek": {
+                    "$in": days_range
+                },
+                "hourOfDay": {
+                    "$in": hour_range
+                }
+            }
+        }
+    ]
+
+
+def historyStages(days_range, hour_range, begin_date, end_date, timezone):
+    # same sums as the rollups, computed from the buckets of the [begin_date, end_date[ window only
+    window, samples_window = {}, {}
+    if begin_date:
+        window["$gte"], samples_window["$gte"] = bucket_start(begin_date), begin_date
+    if end_date:
+        window["$lt"], samples_window["$lt"] = end_date, end_date
+
+    days_filter = {
+        "dayOfWeek": {
+            "$in": days_range
+        },
+        "hourOfDay": {
+            "$in": hour_range
+        }
+    }
+
+    if timezone == TIMEZONE: # days and hours stored in the buckets, the whole match uses the index
+        stages = [
+            {
+                "$match": {
+                    **({"record_timestamp": window} if window else {}),
+                    **days_filter
+                }
+            }
+        ]
+    else:
+        stages = [
+            {
+                "$match": {"record_timestamp": window} if window else {}
+            },
+            {
+                "$addFields": {
                     "dayOfWeek": {
-                        "$dayOfWeek": "$record_timestamp"
+                        "$dayOfWeek": {"date": "$record_timestamp", "timezone": timezone}
                     },
                     "hourOfDay": {
-                        "$hour": "$record_timestamp"
+                        "$hour": {"date": "$record_timestamp", "timezone": timezone}
                     }
-                },
-                "bike_available_avg": {
-                    "$avg": "$nbvelosdispo"
-                },
-                "stand_available_avg": {
-                    "$avg": "$nbplacesdispo"
                 }
+            },
+            {
+                "$match": days_filter
             }
+        ]
+
+    weight = {"$ifNull": ["$samples.nbsamples", 1]} # downsampled samples, see exo2.retention
+    return stages + [
+        {
+            "$unwind": "$samples"
         },
         {
-            "$match": {
-                "_id.dayOfWeek": {
-                    "$in": days_range
+            "$match": {"samples.record_timestamp": samples_window} if samples_window else {}
+        },
+        {
+            "$group": {
+                "_id": {
+                    "station": "$station_id",
+                    "dayOfWeek": "$dayOfWeek",
+                    "hourOfDay": "$hourOfDay"
                 },
-                "_id.hourOfDay": {
-                    "$in": hour_range
+                "sum_velos": {
+                    "$sum": {
+                        "$multiply": ["$samples.nbvelosdispo", weight]
+                    }
+                },
+                "sum_places": {
+                    "$sum": {
+                        "$multiply": ["$samples.nbplacesdispo", weight]
+                    }
                 }
             }
         },
         {
             "$project": {
+                "_id": 0,
+                "station_id": "$_id.station",
+                "dayOfWeek": "$_id.dayOfWeek",
+                "hourOfDay": "$_id.hourOfDay",
+                "sum_velos": 1,
+                "sum_places": 1
+            }
+        }
+    ]
+
+
+def statsQuery(collection_history, compare, ratio, begin_hour, end_hour, begin_week, end_week,
+                begin_date=None, end_date=None, timezone=TIMEZONE):
+    # dates : naive utc datetimes, end excluded ; returns the collection to aggregate and the pipeline,
+    # whose output are live documents
+    days_range = list(range(begin_week, end_week + 1))
+    hour_range = list(range(begin_hour, end_hour + 1))
+
+    if begin_date is None and end_date is None and timezone == TIMEZONE:
+        collection = rollups(collection_history)
+        aggregation = rollupStages(days_range, hour_range)
+    else:
+        collection = collection_history
+        aggregation = historyStages(days_range, hour_range, begin_date, end_date, timezone)
+
+    aggregation += [
+        {
+            "$project": {
+                "_id": {
+                    "station": "$station_id",
+                    "dayOfWeek": "$dayOfWeek",
+                    "hourOfDay": "$hourOfDay"
+                },
                 "ratio": {
                     "$let": {
                         "vars": {
                             "result": {
-                                "$sum": ["$bike_available_avg", "$stand_available_avg"]
+                                "$sum": ["$sum_velos", "$sum_places"]
                             }
                         },
                         "in": {
@@ -49,7 +152,7 @@ def searchByStats(collection_history, compare, ratio, begin_hour, end_hour, begi
                                 "then": {
                                     "$multiply": [
                                         {
-                                            "$divide": ["$bike_available_avg", "$$result"]
+                                            "$divide": ["$sum_velos", "$$result"]
                                         },
                                         100
                                     ]
@@ -95,4 +198,9 @@ def searchByStats(collection_history, compare, ratio, begin_hour, end_hour, begi
         }
     ]
 
-    return collection_history.aggregate(aggregation)
+    return collection, aggregation
+
+
+def searchByStats(collection_history, *args, **kwargs):
+    collection, aggregation = statsQuery(collection_history, *args, **kwargs)
+    return collection.aggregate(aggregation)
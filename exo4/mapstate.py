@@ -0,0 +1,128 @@
+import numpy as np
+
+from exo4.exo4_4.exo import pointsInPolygon
+
+
+PADDING = 0.001 # degrees around the stations of a town, overflow approx
+
+
+class TownStations:
+    # coordinates and state of the stations of one town, one row per station
+
+    def __init__(self, ids, lon, lat, actif):
+        self.ids = list(ids) # row => _id
+        self.rows = {_id: row for row, _id in enumerate(self.ids)} # _id => row
+        self.lon = np.array(lon, dtype=float)
+        self.lat = np.array(lat, dtype=float)
+        self.actif = np.array(actif, dtype=bool)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def flip(self, ids, state):
+        rows = [self.rows[_id] for _id in ids if _id in self.rows]
+        self.actif[rows] = state
+        return len(rows)
+
+
+    def move(self, _id, lon, lat):
+        row = self.rows[_id]
+        self.lon[row], self.lat[row] = lon, lat
+
+
+    def remove(self, ids):
+        # the last row takes the place of each removed one, arrays are shrunk by views
+        removed = 0
+        for _id in ids:
+            row = self.rows.pop(_id, None)
+            if row is None:
+                continue
+
+            last = len(self.ids) - 1
+            if row != last:
+                moved = self.ids[last]
+                self.ids[row], self.rows[moved] = moved, row
+                self.lon[row], self.lat[row], self.actif[row] = self.lon[last], self.lat[last], self.actif[last]
+            self.ids.pop()
+            removed += 1
+
+        size = len(self.ids)
+        self.lon, self.lat, self.actif = self.lon[:size], self.lat[:size], self.actif[:size]
+        return removed
+
+
+    def within(self, polygon):
+        return [self.ids[row] for row in np.flatnonzero(pointsInPolygon(self.lon, self.lat, polygon))]
+
+
+    def boundingBox(self):
+        # (lat min, lat max, lon min, lon max) as laid out on the maps
+        if not len(self):
+            return None
+
+        return (round(float(self.lat.min()) - PADDING, 4),
+                round(float(self.lat.max()) + PADDING, 4),
+                round(float(self.lon.min()) - PADDING, 4),
+                round(float(self.lon.max()) + PADDING, 4))
+
+
+class MapState:
+    # stations shown on the exo4 maps, patched by the admin actions instead of being queried again
+
+    def __init__(self):
+        self.towns = {} # ville => TownStations
+        self.owners = {} # _id => ville
+
+
+    def load(self, storage):
+        self.towns, self.owners = {}, {}
+        for line in storage.town_coordinates():
+            lon, lat, actif = zip(*line["coords"]) if line["coords"] else ((), (), ())
+            self.towns[line["ville"]] = TownStations(line["ids"], lon, lat, actif)
+            self.owners.update((_id, line["ville"]) for _id in line["ids"])
+
+
+    def get(self, town):
+        return self.towns.get(town, TownStations([], [], [], []))
+
+
+    def group(self, ids):
+        # ville => ids of that town, unknown ids are left out
+        towns = {}
+        for _id in ids:
+            if _id in self.owners:
+                towns.setdefault(self.owners[_id], []).append(_id)
+        return towns
+
+
+    def flip(self, ids, state):
+        # towns whose map changed
+        towns = self.group(ids)
+        for town, town_ids in towns.items():
+            self.towns[town].flip(town_ids, state)
+        return set(towns)
+
+
+    def move(self, _id, lon, lat):
+        town = self.owners.get(_id)
+        if town is None:
+            return set()
+
+        self.towns[town].move(_id, lon, lat)
+        return {town}
+
+
+    def remove(self, ids):
+        towns = self.group(ids)
+        for town, town_ids in towns.items():
+            self.towns[town].remove(town_ids)
+            for _id in town_ids:
+                del self.owners[_id]
+        return set(towns)
+
+
+    def within(self, polygon):
+        # ids of the stations inside polygon ([lon, lat] points, see exo4_4.polygons)
+        return [_id for stations in self.towns.values() for _id in stations.within(polygon)]
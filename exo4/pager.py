@@ -0,0 +1,103 @@
+from math import ceil
+
+
+PAGE_SIZE = 50 # stations shown at once
+PREFETCH = 1 # pages fetched ahead of the visible one
+PROJECTION = {
+    "ville": 1,
+    "nom": 1,
+    "actif": 1
+}
+SORTS = { # each one is the key of an index, see MongoStorage.create_indexes
+    "": [("_id", 1)],
+    "Nom": [("nom_normalise", 1), ("_id", 1)],
+    "Ville": [("ville", 1), ("nom_normalise", 1), ("_id", 1)]
+}
+
+
+class MongoQuery:
+    # live stations matched either by a find filter or by an aggregation pipeline whose output documents
+    # are live stations, see MongoStorage.search_query
+
+    def __init__(self, collection, filter=None, pipeline=None):
+        self.collection = collection
+        self.filter = filter or {}
+        self.pipeline = pipeline
+        self.key = (collection.name, repr(self.filter), repr(pipeline)) # identical queries share their pages
+
+
+    def count(self):
+        if self.pipeline is None:
+            return self.collection.count_documents(self.filter)
+
+        result = list(self.collection.aggregate(self.pipeline + [{"$count": "total"}]))
+        return result[0]["total"] if result else 0
+
+
+    def fetch(self, sort, skip, limit, projection=PROJECTION):
+        # sort : key of SORTS, None leaves the order to the server
+        if self.pipeline is None:
+            cursor = self.collection.find(self.filter, projection)
+            if sort is not None:
+                cursor = cursor.sort(SORTS[sort])
+            return list(cursor.skip(skip).limit(limit))
+
+        return list(self.collection.aggregate(self.pipeline + ([
+            {
+                "$sort": dict(SORTS[sort])
+            }
+        ] if sort is not None else []) + [
+            {
+                "$skip": skip
+            },
+            {
+                "$limit": limit
+            },
+            {
+                "$project": projection
+            }
+        ]))
+
+
+class Pager:
+    # lazily fetched pages of a query of the storage, see MongoQuery and storage.sqlite.SQLiteQuery
+
+    def __init__(self, query, sort="", page_size=PAGE_SIZE, prefetch=PREFETCH):
+        self.query = query
+        self.sort = sort
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.pages = {} # number => [station, ...]
+        self.total = None
+
+
+    def sorted(self, sort):
+        return Pager(self.query, sort, self.page_size, self.prefetch)
+
+
+    def count(self):
+        if self.total is None:
+            self.total = self.query.count()
+
+        return self.total
+
+
+    def nb_pages(self):
+        return max(1, ceil(self.count() / self.page_size))
+
+
+    def fetch(self, skip, limit):
+        return self.query.fetch(self.sort, skip, limit)
+
+
+    def page(self, number):
+        # visible page plus the prefetched ones, fetched together when one of them is missing
+        window = [i for i in range(number, number + self.prefetch + 1) if i < self.nb_pages()]
+        if any(i not in self.pages for i in window):
+            stations = self.fetch(number * self.page_size, len(window) * self.page_size)
+
+            self.pages = {key: value for key, value in self.pages.items() if abs(key - number) <= self.prefetch}
+            for i in window:
+                self.pages[i] = stations[(i - number) * self.page_size:(i - number + 1) * self.page_size]
+
+        return self.pages.get(number, [])
@@ -0,0 +1,106 @@
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+from matplotlib.colors import to_rgba
+from PIL import Image
+import threading
+
+
+DISPLAY_HEIGHT = 350 # pixels of the map pictures
+ACTIVE = to_rgba("darkolivegreen")
+INACTIVE = to_rgba("r")
+UNCHANGED = object() # update() argument leaving a layer as it is
+
+
+def ring_path(polygon):
+    # list of polygons (see exo4_4.polygons) => one path, holes wound against their outer ring so they stay empty
+    vertices, codes = [], []
+    for shape in polygon:
+        for i, ring in enumerate(shape):
+            ring = np.asarray(ring, dtype=float)
+            if len(ring) > 1 and (ring[0] == ring[-1]).all():
+                ring = ring[:-1]
+
+            x, y = ring[:, 0], ring[:, 1]
+            if (np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) > 0) == (i > 0): # shoelace, > 0 counterclockwise
+                ring = ring[::-1]
+
+            vertices += [*ring, ring[0]]
+            codes += [Path.MOVETO] + [Path.LINETO] * (len(ring) - 1) + [Path.CLOSEPOLY]
+    return Path(vertices, codes)
+
+
+class MapRenderer:
+    # one city map : the background is rasterised once, stations and polygon are blitted over it
+
+    def __init__(self, image, mapBox, height=DISPLAY_HEIGHT):
+        self.figure = Figure()
+        self.figure.set_dpi(height / self.figure.get_figheight()) # drawn at display resolution
+        self.canvas = FigureCanvasAgg(self.figure)
+
+        ax = self.figure.gca()
+        ax.grid(True)
+        ax.imshow(image, extent=mapBox, zorder=0, aspect='equal')
+        ax.set_xlim(mapBox[0], mapBox[1])
+        ax.set_ylim(mapBox[2], mapBox[3])
+        ax.set_autoscale_on(False)
+        self.ax = ax
+
+        self.stations = ax.scatter([], [], zorder=3, s=10, animated=True)
+        self.area, self.outline = self.add_outlines(Path([[0, 0]]))
+        self.vertices = ax.scatter([], [], c="blue", marker="x", animated=True, visible=False)
+
+        self.canvas.draw() # animated artists are left out of the cached layer
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.lock = threading.Lock()
+
+
+    def add_outlines(self, path):
+        # the patches can't be given a new path before matplotlib 3.8, they are replaced
+        return (self.ax.add_patch(PathPatch(path, zorder=1, alpha=0.2, color="cornflowerblue", animated=True, visible=False)),
+                self.ax.add_patch(PathPatch(path, zorder=2, linestyle='solid', fill=False, color="blue", animated=True, visible=False)))
+
+
+    @property
+    def overlays(self):
+        return sorted([self.area, self.outline, self.stations, self.vertices], key=lambda artist: artist.get_zorder())
+
+
+    def set_stations(self, x, y, actif):
+        self.stations.set_offsets(np.column_stack([x, y]) if len(x) else np.empty((0, 2)))
+        self.stations.set_facecolors(np.where(np.asarray(actif, dtype=bool)[:, None], ACTIVE, INACTIVE) if len(x) else [])
+        self.stations.set_edgecolors("face")
+
+
+    def set_polygon(self, polygon):
+        # polygon : list of polygons, see exo4_4.polygons
+        if polygon is not None:
+            self.area.remove()
+            self.outline.remove()
+            self.area, self.outline = self.add_outlines(ring_path(polygon))
+            self.vertices.set_offsets(np.concatenate([np.asarray(ring, dtype=float) for shape in polygon for ring in shape]))
+
+        for artist in [self.area, self.outline, self.vertices]:
+            artist.set_visible(polygon is not None)
+
+
+    def render(self):
+        self.canvas.restore_region(self.background)
+        for artist in self.overlays:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+
+        width, height = self.canvas.get_width_height()
+        return Image.frombuffer("RGBA", (width, height), bytes(self.canvas.buffer_rgba()), "raw", "RGBA", 0, 1)
+
+
+    def update(self, stations=UNCHANGED, polygon=UNCHANGED):
+        # stations : (x, y, actif) ; sets the given layers and renders, safe from any thread
+        with self.lock:
+            if stations is not UNCHANGED:
+                self.set_stations(*stations)
+            if polygon is not UNCHANGED:
+                self.set_polygon(polygon)
+            return self.render()
@@ -1,28 +1,42 @@
 from pymongo import MongoClient
 from threading import Event
+import sys
 from utils.utils import readJson
 
+from storage.mongo import MongoStorage
+from storage.sqlite import SQLiteStorage
 from exo1.exo import exo1
 from exo2.exo import exo2
 from exo3.exo import exo3
 from exo4.exo import exo4
 
 
-def connectDB(jsonFile):
+def connectDB(jsonFile, **options):
     creds = readJson(jsonFile)
 
     if set(creds.keys()) != set(['username', 'password', 'dbAccess']):
         print(f"Missing keys in your '{jsonFile}' file, close program.")
         exit(1)
 
-    return MongoClient(f"mongodb+srv://{creds['username']}:{creds['password']}@{creds['dbAccess']}", tlsAllowInvalidCertificates=True)
+    return MongoClient(f"mongodb+srv://{creds['username']}:{creds['password']}@{creds['dbAccess']}", tlsAllowInvalidCertificates=True, **options)
+
+
+def connectStorage(backend, jsonFile="credentials.json", path=":memory:"):
+    # backend : "mongo" for the cluster of jsonFile, "sqlite" for an embedded database at path, no cluster needed
+    if backend == "mongo":
+        return MongoStorage(connectDB(jsonFile).TP1)
+    if backend == "sqlite":
+        return SQLiteStorage(path)
+
+    print(f"Unknown storage '{backend}', close program.")
+    exit(1)
 
 
 if __name__ == "__main__":
-    client = connectDB("credentials.json").TP1
-    collection_live = client.live
-    collection_history = client.history
-    print("server's connection established")
+    # python main.py [mongo | sqlite [path]]
+    backend = sys.argv[1] if len(sys.argv) > 1 else "mongo"
+    storage = connectStorage(backend, path=sys.argv[2] if len(sys.argv) > 2 else ":memory:")
+    print(f"{backend} storage ready")
 
     evt_end = Event()
 
@@ -50,7 +64,7 @@ if __name__ == "__main__":
         for i, exo in enumerate(exos):
             print(f"\nexo {i+1}:")
 
-            exo["ptr"](collection_live, collection_history, *exo["args"])
+            exo["ptr"](storage, *exo["args"])
 
     finally:
         # input("\nPress enter to close program...")
@@ -0,0 +1,234 @@
+from aiohttp import web
+from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Event
+import argparse
+import asyncio
+import json
+import os
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from storage.mongo import MongoStorage
+from exo3.queries import getClosestStations, findClosestStations
+from exo4.exo4_1.exo import AUTOCOMPLETE_LIMIT
+from exo4.exo4_4.exo import polygons
+from exo4.exo4_5.exo import localDate, TIMEZONE
+
+
+HOST = "0.0.0.0"
+PORT = 8080
+MONGO_POOL = 64 # connections of the shared client
+QUERY_WORKERS = 64 # blocking pymongo calls running at the same time, one connection each
+DEFAULT_LIMIT = 100 # stations per response
+MAX_LIMIT = 1000
+COMPRESS_MIN = 1024 # bytes, smaller responses are sent as they are
+PROJECTION = {
+    "nom": 1,
+    "ville": 1,
+    "actif": 1,
+    "nbvelosdispo": 1,
+    "nbplacesdispo": 1,
+    "nbplacestotal": 1,
+    "geometry": 1
+}
+COMPARE = {
+    "gt": "$gt",
+    "gte": "$gte",
+    "eq": "$eq",
+    "lte": "$lte",
+    "lt": "$lt"
+}
+
+
+class ValidationError(Exception):
+    # bad request from the client, answered with a 400
+    pass
+
+
+def parameter(query, name, cast=str, default=None):
+    if name not in query:
+        if default is None:
+            raise ValidationError(f"missing parameter '{name}'")
+        return default
+
+    try:
+        return cast(query[name])
+    except ValueError:
+        raise ValidationError(f"bad value for '{name}' : {query[name]!r}")
+
+
+def zone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"unknown timezone {name!r}")
+    return name
+
+
+def limit(query, default=DEFAULT_LIMIT):
+    return min(max(parameter(query, "limit", int, default), 1), MAX_LIMIT)
+
+
+def dumps(data):
+    return json.dumps(data, default=str, ensure_ascii=False) # datetimes and ObjectIds as strings
+
+
+@web.middleware
+async def errors(request, handler):
+    try:
+        return await handler(request)
+    except ValidationError as e:
+        return web.json_response({"error": str(e)}, status=400, dumps=dumps)
+    except web.HTTPException:
+        raise # 404, 405... answered by aiohttp
+    except Exception as e:
+        print("something went wrong...")
+        print(type(e))
+        print(e)
+        return web.json_response({"error": "internal error"}, status=500, dumps=dumps)
+
+
+@web.middleware
+async def compression(request, handler):
+    response = await handler(request)
+    if isinstance(response, web.Response) and response.body is not None and len(response.body) >= COMPRESS_MIN:
+        response.enable_compression() # gzip or deflate, as accepted by the client
+    return response
+
+
+class QueryService:
+    # json endpoints over the exo3/exo4 queries of storage, blocking calls run on a thread pool sharing one client
+
+    def __init__(self, storage, cached=False):
+        self.storage = storage
+        self.pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+        # the index and the result cache are only up to date next to a running refresh, see main()
+        self.closest = getClosestStations if cached else findClosestStations
+
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, partial(function, *args))
+
+
+    def respond(self, data):
+        return web.json_response(data, dumps=dumps)
+
+
+    async def closestStations(self, request):
+        query = request.query
+        args = ([parameter(query, "lon", float), parameter(query, "lat", float)],
+                parameter(query, "min", float, 0.0),
+                parameter(query, "max", float, 400.0),
+                limit(query, 3))
+
+        result = await self.run(self.closest, self.storage, *args)
+        return self.respond(result[0] if result else {"closest_results": [], "nb_stations": 0})
+
+
+    async def searchStations(self, request):
+        query = request.query
+        args = (parameter(query, "town", str, "Tous"),
+                parameter(query, "name", str, ""),
+                parameter(query, "prefix", lambda value: value in ["1", "true"], False))
+
+        find = self.storage.search_query(*args).fetch
+        return self.respond(await self.run(find, None, 0, limit(query), PROJECTION))
+
+
+    async def autocompleteStations(self, request):
+        # names beginning with text, for the search forms
+        query = request.query
+        town, text = parameter(query, "town", str, "Tous"), parameter(query, "text")
+        if not text.strip():
+            return self.respond([])
+
+        return self.respond(await self.run(self.storage.autocomplete, town, text, limit(query, AUTOCOMPLETE_LIMIT)))
+
+
+    async def polygonStations(self, request):
+        # body : {"polygon": ring, polygon with holes or list of polygons, [lon, lat] points}
+        try:
+            polygon = (await request.json())["polygon"]
+            polygons(polygon)
+        except (json.JSONDecodeError, TypeError, KeyError, IndexError, ValueError) as e:
+            raise ValidationError(f"bad body, a json {{\"polygon\": ...}} is expected : {e}")
+
+        find = lambda: self.storage.within_query(polygon).fetch(None, 0, limit(request.query), PROJECTION)
+        return self.respond(await self.run(find))
+
+
+    async def statsStations(self, request):
+        query = request.query
+        timezone = parameter(query, "timezone", zone, TIMEZONE)
+        compare = parameter(query, "compare", str, "lt")
+        if compare not in COMPARE:
+            raise ValidationError(f"bad value for 'compare' : {compare!r}, one of {list(COMPARE)}")
+        stats = self.storage.stats_query(COMPARE[compare],
+                                         parameter(query, "ratio", float, 20.0),
+                                         parameter(query, "begin_hour", int, 0),
+                                         parameter(query, "end_hour", int, 23),
+                                         parameter(query, "begin_week", int, 1),
+                                         parameter(query, "end_week", int, 7),
+                                         begin_date=parameter(query, "begin_date", lambda text: localDate(text, timezone), "") or None,
+                                         end_date=parameter(query, "end_date", lambda text: localDate(text, timezone, days=1), "") or None,
+                                         timezone=timezone)
+
+        return self.respond(await self.run(stats.fetch, None, 0, limit(query), PROJECTION))
+
+
+    def application(self):
+        app = web.Application(middlewares=[errors, compression])
+        app.add_routes([
+            web.get("/stations/closest", self.closestStations),
+            web.get("/stations/search", self.searchStations),
+            web.get("/stations/autocomplete", self.autocompleteStations),
+            web.post("/stations/polygon", self.polygonStations),
+            web.get("/stations/stats", self.statsStations)
+        ])
+        app.on_cleanup.append(self.close)
+        return app
+
+
+    async def close(self, _):
+        self.pool.shutdown(wait=False)
+
+
+def connect():
+    # SERVICE_MONGO_URI for a local mongod, the credentials.json cluster otherwise
+    uri = os.environ.get("SERVICE_MONGO_URI")
+    if uri:
+        return MongoClient(uri, maxPoolSize=MONGO_POOL).get_database(os.environ.get("SERVICE_DB", "TP1"))
+
+    from main import connectDB
+    return connectDB("credentials.json", maxPoolSize=MONGO_POOL).TP1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="json http service over the live and history collections")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--refresh", action="store_true",
+                        help="run the exo2 refresh in the process, nearest stations then use the index and the cache")
+    args = parser.parse_args()
+
+    storage = MongoStorage(connect())
+    evt_end = Event()
+    if args.refresh:
+        from exo2.exo import exo2, add_refresh_listener
+        from exo3.spatial import stationIndex
+        from exo3.cache import resultCache
+
+        add_refresh_listener(stationIndex.update)
+        add_refresh_listener(resultCache.invalidate)
+        stationIndex.load(storage)
+        exo2(storage, evt_end)
+
+    try:
+        web.run_app(QueryService(storage, cached=args.refresh).application(), host=args.host, port=args.port)
+    finally:
+        evt_end.set()
+
+
+if __name__ == "__main__":
+    main()
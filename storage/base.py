@@ -0,0 +1,173 @@
+from abc import ABC, abstractmethod
+from itertools import groupby
+
+from exo2.history import bucket_start, TIMEZONE
+from exo4.exo4_1.exo import AUTOCOMPLETE_LIMIT
+
+
+class Storage(ABC):
+    # operations the exercises run against their database, see storage.mongo and storage.sqlite
+    # stations are live documents (see utils.mapper.compile_static), points are [lon, lat]
+    # groups are [(station_id, samples)], the samples of one station in one hour, see exo2.buffer
+
+    @abstractmethod
+    def clear(self):
+        # exo1 : empties live before the bootstrap
+        pass
+
+
+    @abstractmethod
+    def create_indexes(self):
+        # exo1 : once the stations are in, returns what was created
+        pass
+
+
+    @abstractmethod
+    def insert_stations(self, stations):
+        # exo1 bootstrap, returns the number of stations inserted
+        pass
+
+
+    @abstractmethod
+    def update_counts(self, datas):
+        # exo2 refresh : [{"_id", "nbvelosdispo", "nbplacesdispo"}], returns the number of stations matched
+        pass
+
+
+    @abstractmethod
+    def existing(self, ids):
+        # exo2 refresh : the ids still in live
+        pass
+
+
+    @abstractmethod
+    def write_history(self, groups):
+        # exo2 history : returns the positions of the groups not written, raises when none was
+        pass
+
+
+    @abstractmethod
+    def write_rollups(self, groups):
+        # exo2 history : running sums per station, local weekday and hour, same return as write_history
+        pass
+
+
+    def append_history(self, samples):
+        # [(station_id, {"record_timestamp", "nbvelosdispo", "nbplacesdispo"})], rollups included
+        key = lambda item: (item[0], bucket_start(item[1]["record_timestamp"]))
+        groups = [(station_id, [sample for _, sample in group])
+                    for (station_id, _), group in groupby(sorted(samples, key=key), key=key)]
+        if not groups:
+            return 0
+
+        self.write_history(groups)
+        self.write_rollups(groups)
+        return len(samples)
+
+
+    @abstractmethod
+    def stations(self):
+        # exo3 station index : every live station, with at least nom, ville, geometry and the counts
+        pass
+
+
+    @abstractmethod
+    def closest(self, coordinates, minDistance, maxDistance, closest):
+        # exo3 : same result as exo3.exo.geoNearStations
+        pass
+
+
+    @abstractmethod
+    def within(self, polygon):
+        # exo4_4 : stations inside a ring, a polygon with holes or a list of polygons
+        pass
+
+
+    @abstractmethod
+    def search(self, town, station, prefix=False):
+        # exo4_1 : town or "Tous", substring of the name or its beginning when prefix
+        pass
+
+
+    @abstractmethod
+    def stats(self, compare, ratio, begin_hour, end_hour, begin_week, end_week):
+        # exo4_5 : one station per (station, day, hour) rollup whose ratio matches, compare as "$lt", "$gte"...
+        pass
+
+
+    @abstractmethod
+    def autocomplete(self, town, text, limit=AUTOCOMPLETE_LIMIT):
+        # exo4_1 : [{"nom", "ville"}] of the names beginning with text, sorted
+        pass
+
+
+    @abstractmethod
+    def search_query(self, town, station, prefix=False):
+        # exo4 pages : same stations as search, as a query paged by exo4.pager.Pager
+        # queries have a key, count() and fetch(sort, skip, limit, projection), see exo4.pager.MongoQuery
+        pass
+
+
+    @abstractmethod
+    def ids_query(self, ids):
+        # exo4 pages : the live stations of ids
+        pass
+
+
+    @abstractmethod
+    def within_query(self, polygon):
+        # exo4 pages : same stations as within
+        pass
+
+
+    @abstractmethod
+    def stats_query(self, compare, ratio, begin_hour, end_hour, begin_week, end_week,
+                    begin_date=None, end_date=None, timezone=TIMEZONE):
+        # exo4 pages : same stations as stats, in the [begin_date, end_date[ window (naive utc) when given
+        pass
+
+
+    @abstractmethod
+    def towns(self):
+        # exo4 : the villes of live, sorted
+        pass
+
+
+    @abstractmethod
+    def find(self, ids):
+        # exo4 : the whole live documents of ids, those deleted meanwhile are left out
+        pass
+
+
+    @abstractmethod
+    def town_coordinates(self):
+        # exo4 maps : [{"ville", "ids", "coords": [[lon, lat, actif], ...]}], ids and coords in the same order
+        pass
+
+
+    @abstractmethod
+    def update_stations(self, edits):
+        # exo4_2 : [(_id, version read, {field: value})], an edit whose station changed since it was read
+        # is rejected, returns the rejected _ids
+        pass
+
+
+    @abstractmethod
+    def flip_stations(self, ids, state):
+        # exo4_4 : sets actif
+        pass
+
+
+    @abstractmethod
+    def delete_stations(self, ids):
+        # exo4_3 : the stations and their history
+        pass
+
+
+    def workers(self):
+        # background maintenance exo2 starts next to the refresh : [(function, args)], evt_end is appended
+        return []
+
+
+    def close(self):
+        pass
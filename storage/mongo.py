@@ -0,0 +1,167 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from storage.base import Storage
+from exo2.history import bucket_update, rollup_update, rollups, create_history_indexes, TIMEZONE
+from exo2.retention import retention_worker
+from exo2.purge import purge_worker
+from exo3.queries import geoNearStations
+from exo4.exo4_1.exo import searchByTownAndStation, autocompleteStation, stationFilter, getTowns, AUTOCOMPLETE_LIMIT
+from exo4.exo4_2.exo import updateStations
+from exo4.exo4_3.exo import deleteStation
+from exo4.exo4_4.exo import searchByPolygon, polygonFilter, flipStations, getCoordsByTown
+from exo4.exo4_5.exo import searchByStats, statsQuery
+from exo4.pager import MongoQuery
+
+
+STATION_FIELDS = {
+    "nom": 1,
+    "ville": 1,
+    "geometry": 1,
+    "nbvelosdispo": 1,
+    "nbplacesdispo": 1
+}
+
+
+def failed(collection, operations):
+    # unordered bulk write, returns the positions of the operations that failed
+    try:
+        collection.bulk_write(operations, ordered=False)
+        return []
+
+    except BulkWriteError as bwe:
+        print(f"'{collection.name}' - bulk_write error :")
+        print(f"Errors : {len(bwe.details['writeErrors'])}")
+        return [error["index"] for error in bwe.details["writeErrors"]] # the others were applied
+
+
+class MongoStorage(Storage):
+    # the collections the exercises use, through their own queries
+
+    def __init__(self, db):
+        self.live = db.live
+        self.history = db.history
+
+
+    def clear(self):
+        self.live.delete_many({})
+        self.live.drop_indexes()
+
+
+    def create_indexes(self):
+        # built once the data is loaded, cheaper than maintaining them insert after insert
+        # the name indexes end with _id : they serve the searches and the sorts of exo4.pager.SORTS
+        return [
+            self.live.create_index([("geometry", "2dsphere")]),
+            self.live.create_index([("ville", 1), ("nom_normalise", 1), ("_id", 1)]),
+            self.live.create_index([("nom_normalise", 1), ("_id", 1)]),
+            self.live.create_index([("nom_ngrams", 1)]),
+            *create_history_indexes(self.history)
+        ]
+
+
+    def insert_stations(self, stations):
+        try:
+            return len(self.live.insert_many(stations, ordered=False).inserted_ids)
+
+        except BulkWriteError as bwe:
+            print(f"Live collection - {len(bwe.details['writeErrors'])} write errors")
+            return bwe.details["nInserted"]
+
+
+    def update_counts(self, datas):
+        if not datas:
+            return 0
+
+        return self.live.bulk_write([
+            UpdateOne(
+                {"_id": data["_id"]},
+                {"$set": {
+                    "nbvelosdispo": data["nbvelosdispo"],
+                    "nbplacesdispo": data["nbplacesdispo"]
+                }}
+            )
+            for data in datas], ordered=False).matched_count
+
+
+    def existing(self, ids):
+        return {station["_id"] for station in self.live.find({"_id": {"$in": list(ids)}}, {"_id": 1})}
+
+
+    def write_history(self, groups):
+        return failed(self.history, [bucket_update(*group) for group in groups])
+
+
+    def write_rollups(self, groups):
+        return failed(rollups(self.history), [rollup_update(*group) for group in groups])
+
+
+    def stations(self):
+        return self.live.find({}, STATION_FIELDS)
+
+
+    def closest(self, coordinates, minDistance, maxDistance, closest):
+        return geoNearStations(self.live, coordinates, minDistance, maxDistance, closest)
+
+
+    def within(self, polygon):
+        return list(searchByPolygon(self.live, polygon))
+
+
+    def search(self, town, station, prefix=False):
+        return list(searchByTownAndStation(self.live, town, station, prefix))
+
+
+    def stats(self, compare, ratio, begin_hour, end_hour, begin_week, end_week):
+        return list(searchByStats(self.history, compare, ratio, begin_hour, end_hour, begin_week, end_week))
+
+
+    def autocomplete(self, town, text, limit=AUTOCOMPLETE_LIMIT):
+        return list(autocompleteStation(self.live, town, text, limit))
+
+
+    def search_query(self, town, station, prefix=False):
+        return MongoQuery(self.live, stationFilter(town, station, prefix))
+
+
+    def ids_query(self, ids):
+        return MongoQuery(self.live, {"_id": {"$in": list(ids)}})
+
+
+    def within_query(self, polygon):
+        return MongoQuery(self.live, polygonFilter(polygon)) # 2dsphere index
+
+
+    def stats_query(self, compare, ratio, begin_hour, end_hour, begin_week, end_week,
+                    begin_date=None, end_date=None, timezone=TIMEZONE):
+        collection, aggregation = statsQuery(self.history, compare, ratio, begin_hour, end_hour, begin_week, end_week,
+                                            begin_date, end_date, timezone)
+        return MongoQuery(collection, pipeline=aggregation)
+
+
+    def towns(self):
+        return [line["_id"] for line in getTowns(self.live)]
+
+
+    def find(self, ids):
+        return list(self.live.find({"_id": {"$in": list(ids)}}))
+
+
+    def town_coordinates(self):
+        return getCoordsByTown(self.live)
+
+
+    def update_stations(self, edits):
+        return updateStations(self.live, edits)
+
+
+    def flip_stations(self, ids, state):
+        flipStations(self.live, ids, state)
+
+
+    def delete_stations(self, ids):
+        deleteStation(self.live, self.history, ids) # history purged in background, see exo2.purge
+
+
+    def workers(self):
+        return [(retention_worker, (self.history,)), (purge_worker, (self.history,))]
@@ -0,0 +1,396 @@
+from math import radians, degrees, sin, cos, asin, sqrt
+from itertools import groupby
+import json
+import sqlite3
+import threading
+
+from storage.base import Storage
+from utils.utils import normalize
+from exo2.history import local_day_hour, TIMEZONE
+from exo3.spatial import EARTH_RADIUS, bearing
+from exo4.exo4_1.exo import AUTOCOMPLETE_LIMIT
+from exo4.exo4_4.exo import polygons, pointsInPolygon
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS live (
+    id TEXT PRIMARY KEY,
+    ville TEXT NOT NULL,
+    nom TEXT NOT NULL,
+    nom_normalise TEXT NOT NULL,
+    actif INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    nbvelosdispo INTEGER NOT NULL,
+    nbplacesdispo INTEGER NOT NULL,
+    nbplacestotal INTEGER,
+    lon REAL NOT NULL,
+    lat REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS live_ville_nom ON live (ville, nom_normalise, id);
+CREATE INDEX IF NOT EXISTS live_nom ON live (nom_normalise, id);
+
+-- spatial index, one box per station, keyed by the live rowid
+CREATE VIRTUAL TABLE IF NOT EXISTS live_rtree USING rtree (station, min_lon, max_lon, min_lat, max_lat);
+
+CREATE TABLE IF NOT EXISTS history (
+    station_id TEXT NOT NULL,
+    record_timestamp TEXT NOT NULL,
+    dayOfWeek INTEGER NOT NULL,
+    hourOfDay INTEGER NOT NULL,
+    nbvelosdispo INTEGER NOT NULL,
+    nbplacesdispo INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_station ON history (station_id, record_timestamp);
+CREATE INDEX IF NOT EXISTS history_time ON history (dayOfWeek, hourOfDay, record_timestamp);
+
+CREATE TABLE IF NOT EXISTS history_rollups (
+    station_id TEXT NOT NULL,
+    dayOfWeek INTEGER NOT NULL,
+    hourOfDay INTEGER NOT NULL,
+    sum_velos REAL NOT NULL,
+    sum_places REAL NOT NULL,
+    nbsamples INTEGER NOT NULL,
+    PRIMARY KEY (station_id, dayOfWeek, hourOfDay)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS history_rollups_time ON history_rollups (dayOfWeek, hourOfDay);
+"""
+COLUMNS = "live.rowid, id, ville, nom, actif, version, nbvelosdispo, nbplacesdispo, nbplacestotal, lon, lat"
+ORDERS = { # same as exo4.pager.SORTS, on the live indexes
+    "": "live.id",
+    "Nom": "nom_normalise, live.id",
+    "Ville": "ville, nom_normalise, live.id"
+}
+IDS = "live.id IN (SELECT value FROM json_each(?))" # one json argument, whatever the number of ids
+EDITABLE = ["ville", "nom", "nbplacestotal"] # fields of the exo4 edit panel stored in live
+OPERATORS = {
+    "$gt": ">",
+    "$gte": ">=",
+    "$eq": "=",
+    "$lte": "<=",
+    "$lt": "<"
+}
+
+
+def document(row):
+    # live document as mongo stores it
+    _, _id, ville, nom, actif, version, velos, places, total, lon, lat = row
+    return {
+        "_id": _id,
+        "ville": ville,
+        "nom": nom,
+        "actif": bool(actif),
+        "version": version,
+        "nbvelosdispo": velos,
+        "nbplacesdispo": places,
+        "nbplacestotal": total,
+        "geometry": {
+            "type": "Point",
+            "coordinates": [lon, lat]
+        }
+    }
+
+
+class SQLiteQuery:
+    # live stations selected by "<tables> WHERE <condition>", paged as exo4.pager.MongoQuery
+
+    def __init__(self, storage, source, args=()):
+        self.storage = storage
+        self.source = source
+        self.args = tuple(args)
+        self.key = (source, repr(self.args))
+
+
+    def count(self):
+        with self.storage.lock:
+            return self.storage.db.execute(f"SELECT COUNT(*) FROM {self.source}", self.args).fetchone()[0]
+
+
+    def fetch(self, sort, skip, limit, projection=None):
+        # every column is read, projection is only used by mongo ; limit None for all of them
+        order = f"ORDER BY {ORDERS[sort]}" if sort is not None else ""
+        with self.storage.lock:
+            rows = self.storage.db.execute(f"SELECT {COLUMNS} FROM {self.source} {order} LIMIT ? OFFSET ?",
+                                            (*self.args, -1 if limit is None else limit, skip)).fetchall()
+        return [document(row) for row in rows]
+
+
+class SQLiteStorage(Storage):
+    # embedded engine : in memory by default, r-tree for the geo queries, indexed history and rollups
+
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM live")
+            self.db.execute("DELETE FROM live_rtree")
+
+
+    def create_indexes(self):
+        # created with the tables, see SCHEMA
+        with self.lock:
+            return [name for name, in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")]
+
+
+    def insert_stations(self, stations):
+        with self.lock, self.db:
+            inserted = 0
+            for station in stations:
+                lon, lat = station["geometry"]["coordinates"]
+                normalised = normalize(station["nom"])
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO live (id, ville, nom, nom_normalise, actif, version, nbvelosdispo, nbplacesdispo, " +
+                    "nbplacestotal, lon, lat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (station["_id"], station["ville"], station["nom"], normalised, int(station["actif"]), station.get("version", 0),
+                    station["nbvelosdispo"], station["nbplacesdispo"], station.get("nbplacestotal"), lon, lat))
+                if not cursor.rowcount:
+                    continue
+
+                station = cursor.lastrowid
+                self.db.execute("INSERT INTO live_rtree VALUES (?, ?, ?, ?, ?)", (station, lon, lon, lat, lat))
+                inserted += 1
+
+        return inserted
+
+
+    def update_counts(self, datas):
+        with self.lock, self.db:
+            return self.db.executemany("UPDATE live SET nbvelosdispo = ?, nbplacesdispo = ? WHERE id = ?",
+                                        [(data["nbvelosdispo"], data["nbplacesdispo"], data["_id"]) for data in datas]).rowcount
+
+
+    def existing(self, ids):
+        ids = list(ids)
+        with self.lock:
+            return {_id for _id, in self.db.execute(f"SELECT id FROM live WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+
+
+    def write_history(self, groups):
+        rows = []
+        for station_id, samples in groups:
+            for sample in samples:
+                day, hour = local_day_hour(sample["record_timestamp"])
+                rows.append((station_id, sample["record_timestamp"].isoformat(), day, hour,
+                            sample["nbvelosdispo"], sample["nbplacesdispo"]))
+
+        with self.lock, self.db: # one transaction : every group is written or none
+            # samples flushed after their station was deleted are dropped, see delete_stations
+            self.db.executemany("INSERT INTO history SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM live WHERE id = ?)",
+                                [(*row, row[0]) for row in rows])
+        return []
+
+
+    def write_rollups(self, groups):
+        rows = []
+        for station_id, samples in groups:
+            day, hour = local_day_hour(samples[0]["record_timestamp"])
+            rows.append((station_id, day, hour, sum(sample["nbvelosdispo"] for sample in samples),
+                        sum(sample["nbplacesdispo"] for sample in samples), len(samples)))
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT INTO history_rollups SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM live WHERE id = ?) " +
+                "ON CONFLICT (station_id, dayOfWeek, hourOfDay) " +
+                "DO UPDATE SET sum_velos = sum_velos + excluded.sum_velos, sum_places = sum_places + excluded.sum_places, " +
+                "nbsamples = nbsamples + excluded.nbsamples", [(*row, row[0]) for row in rows])
+        return []
+
+
+    def box(self, min_lon, max_lon, min_lat, max_lat, where="1", args=()):
+        with self.lock:
+            return self.db.execute(
+                f"SELECT {COLUMNS} FROM live_rtree JOIN live ON live.rowid = live_rtree.station " +
+                f"WHERE max_lon >= ? AND min_lon <= ? AND max_lat >= ? AND min_lat <= ? AND {where}",
+                (min_lon, max_lon, min_lat, max_lat, *args)).fetchall()
+
+
+    def closest(self, coordinates, minDistance, maxDistance, closest):
+        lon, lat = coordinates
+        dlat = degrees(maxDistance / EARTH_RADIUS)
+        dlon = dlat / max(cos(radians(lat)), 1e-6)
+
+        results = []
+        for row in self.box(lon - dlon, lon + dlon, lat - dlat, lat + dlat, "nbvelosdispo > 0"):
+            station_lon, station_lat = row[-2:]
+            # haversine on the same sphere as $geoNear
+            a = sin(radians(station_lat - lat) / 2) ** 2 + \
+                cos(radians(lat)) * cos(radians(station_lat)) * sin(radians(station_lon - lon) / 2) ** 2
+            distance = 2 * EARTH_RADIUS * asin(min(1, sqrt(a)))
+            if minDistance <= distance <= maxDistance:
+                results.append((distance, row))
+
+        if not results:
+            return []
+
+        results.sort(key=lambda result: result[0])
+        return [{
+            "closest_results": [{
+                "nom": row[3],
+                "velos": row[6],
+                "places": row[7],
+                "distance": distance,
+                "bearing": bearing(lon, lat, row[-2], row[-1])
+            } for distance, row in results[:closest]],
+            "nb_stations": len(results)
+        }]
+
+
+    def within(self, polygon):
+        outers = [shape[0] for shape in polygons(polygon)]
+        rows = self.box(min(x for ring in outers for x, _ in ring), max(x for ring in outers for x, _ in ring),
+                        min(y for ring in outers for _, y in ring), max(y for ring in outers for _, y in ring))
+        if not rows:
+            return []
+
+        mask = pointsInPolygon([row[-2] for row in rows], [row[-1] for row in rows], polygon)
+        return [document(row) for row, inside in zip(rows, mask) if inside]
+
+
+    def search(self, town, station, prefix=False):
+        return self.search_query(town, station, prefix).fetch(None, 0, None)
+
+
+    def stats(self, compare, ratio, begin_hour, end_hour, begin_week, end_week):
+        return self.stats_query(compare, ratio, begin_hour, end_hour, begin_week, end_week).fetch(None, 0, None)
+
+
+    def autocomplete(self, town, text, limit=AUTOCOMPLETE_LIMIT):
+        return [{"nom": station["nom"], "ville": station["ville"]}
+                for station in self.search_query(town, text, prefix=True).fetch("Nom", 0, limit)]
+
+
+    def search_query(self, town, station, prefix=False):
+        where, args = [], []
+        if town != "Tous":
+            where.append("ville = ?")
+            args.append(town)
+
+        text = normalize(station) if station else ""
+        if text and prefix:
+            where.append("nom_normalise >= ? AND nom_normalise < ?") # range on the name index
+            args += [text, text + "\U0010ffff"]
+        elif text:
+            # a scan of the short names is cheaper here than an ngram table, unlike mongo
+            where.append("instr(nom_normalise, ?) > 0")
+            args.append(text)
+
+        return SQLiteQuery(self, f"live WHERE {' AND '.join(where) or '1'}", args)
+
+
+    def ids_query(self, ids):
+        return SQLiteQuery(self, f"live WHERE {IDS}", [json.dumps(list(ids))])
+
+
+    def within_query(self, polygon):
+        return self.ids_query([station["_id"] for station in self.within(polygon)])
+
+
+    def stats_query(self, compare, ratio, begin_hour, end_hour, begin_week, end_week,
+                    begin_date=None, end_date=None, timezone=TIMEZONE):
+        if timezone != TIMEZONE:
+            raise ValueError(f"only the days and hours of {TIMEZONE} are stored, not those of {timezone}")
+
+        if begin_date is None and end_date is None:
+            sums, args = "history_rollups", []
+        else:
+            # same sums as the rollups, from the samples of the window only
+            window, args = [], []
+            if begin_date:
+                window.append("record_timestamp >= ?")
+                args.append(begin_date.isoformat())
+            if end_date:
+                window.append("record_timestamp < ?")
+                args.append(end_date.isoformat())
+            sums = "(SELECT station_id, dayOfWeek, hourOfDay, SUM(nbvelosdispo) AS sum_velos, " + \
+                    f"SUM(nbplacesdispo) AS sum_places FROM history WHERE {' AND '.join(window)} " + \
+                    "GROUP BY station_id, dayOfWeek, hourOfDay)"
+
+        ratio_sql = "sum_velos * 100.0 / (sum_velos + sum_places)"
+        return SQLiteQuery(self,
+            f"{sums} AS sums JOIN live ON live.id = sums.station_id " +
+            "WHERE dayOfWeek BETWEEN ? AND ? AND hourOfDay BETWEEN ? AND ? AND sum_velos + sum_places != 0 " +
+            f"AND {ratio_sql} {OPERATORS[compare]} ?",
+            [*args, begin_week, end_week, begin_hour, end_hour, ratio])
+
+
+    def towns(self):
+        with self.lock:
+            return [ville for ville, in self.db.execute("SELECT DISTINCT ville FROM live ORDER BY ville")]
+
+
+    def find(self, ids):
+        return self.ids_query(ids).fetch(None, 0, None)
+
+
+    def town_coordinates(self):
+        with self.lock:
+            rows = self.db.execute("SELECT ville, id, lon, lat, actif FROM live ORDER BY ville").fetchall()
+
+        lines = []
+        for ville, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            lines.append({
+                "ville": ville,
+                "ids": [row[1] for row in group],
+                "coords": [[lon, lat, bool(actif)] for _, _, lon, lat, actif in group]
+            })
+        return lines
+
+
+    def update_stations(self, edits):
+        # one guarded update per station, the version tells the stale edits apart
+        rejected, applied = [], 0
+        with self.lock, self.db:
+            for _id, version, patch in edits:
+                columns = {key: patch[key] for key in EDITABLE if key in patch}
+                if "nom" in columns:
+                    columns["nom_normalise"] = normalize(columns["nom"])
+                if "geometry" in patch:
+                    columns["lon"], columns["lat"] = patch["geometry"]["coordinates"]
+                if not columns:
+                    continue
+
+                sets = ", ".join(f"{column} = ?" for column in columns)
+                cursor = self.db.execute(f"UPDATE live SET {sets}, version = version + 1 WHERE id = ? AND version = ?",
+                                        (*columns.values(), _id, version or 0))
+                if not cursor.rowcount:
+                    rejected.append(_id)
+                    continue
+
+                applied += 1
+                if "lon" in columns:
+                    self.db.execute("UPDATE live_rtree SET min_lon = ?, max_lon = ?, min_lat = ?, max_lat = ? " +
+                                    "WHERE station = (SELECT rowid FROM live WHERE id = ?)",
+                                    (columns["lon"], columns["lon"], columns["lat"], columns["lat"], _id))
+
+        print(f"=> updated {applied}/{applied + len(rejected)} lines, {len(rejected)} stale edits rejected")
+        return rejected
+
+
+    def flip_stations(self, ids, state):
+        with self.lock, self.db:
+            updated = self.db.execute(f"UPDATE live SET actif = ?, version = version + 1 WHERE {IDS}",
+                                        (int(state), json.dumps(list(ids)))).rowcount
+        print(f"=> updated {updated}/{len(ids)} lines")
+
+
+    def delete_stations(self, ids):
+        # the history goes with the stations, in the same transaction
+        ids = json.dumps(list(ids))
+        with self.lock, self.db:
+            self.db.execute(f"DELETE FROM live_rtree WHERE station IN (SELECT rowid FROM live WHERE {IDS})", (ids,))
+            deleted = self.db.execute(f"DELETE FROM live WHERE {IDS}", (ids,)).rowcount
+            for table in ["history", "history_rollups"]:
+                self.db.execute(f"DELETE FROM {table} WHERE station_id IN (SELECT value FROM json_each(?))", (ids,))
+        print(f"=> {deleted} selected stations erased with their history")
+
+
+    def stations(self):
+        return self.search("Tous", None)
+
+
+    def close(self):
+        self.db.close()
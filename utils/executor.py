@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from itertools import count
+from time import monotonic
+import queue
+
+
+QUERY_WORKERS = 4 # queries running at the same time
+QUERY_TIMEOUT = 30 # seconds before a request is given up
+POLL_INTERVAL = 16 # milliseconds between two looks at the results, ~60 fps
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryExecutor:
+    # runs the gui queries on a thread pool, their callbacks are run back on the Tk thread by poll()
+    # submit and poll are only called from the Tk thread, workers only touch the results queue
+
+    def __init__(self, workers=QUERY_WORKERS, timeout=QUERY_TIMEOUT):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.timeout = timeout
+        self.results = queue.SimpleQueue() # (key, future) once a query is over
+        self.ids = count()
+        self.requests = {} # request id => (slot, key, future, callback, errback, deadline)
+        self.latest = {} # slot => id of the last request submitted in it
+        self.futures = {} # key => future of the query in flight
+        self.waiting = {} # future => ids of the requests waiting for it
+
+
+    def start(self, app):
+        app.repeat(POLL_INTERVAL, self.poll)
+
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+    def submit(self, slot, key, function, args, callback, errback=None):
+        # slot : a new request supersedes the previous one of the same slot
+        # key : identical requests in flight share one query, None when it can't be shared
+        key = (slot, next(self.ids)) if key is None else key
+
+        future = self.futures.get(key)
+        if future is None:
+            future = self.pool.submit(function, *args)
+            self.futures[key] = future
+            future.add_done_callback(lambda future: self.results.put((key, future)))
+
+        # attached before the superseded request is dropped, so a shared query is kept running
+        request = next(self.ids)
+        self.requests[request] = (slot, key, future, callback, errback, monotonic() + self.timeout)
+        self.waiting.setdefault(future, []).append(request)
+
+        superseded = self.latest.get(slot)
+        self.latest[slot] = request
+        if superseded is not None:
+            self.drop(superseded, CancelledError("superseded"))
+
+        return request
+
+
+    def drop(self, request, error):
+        if request not in self.requests:
+            return
+
+        slot, key, future, _, errback, _ = self.requests.pop(request)
+        if self.latest.get(slot) == request:
+            del self.latest[slot]
+
+        waiting = self.waiting.get(future, [])
+        if request in waiting:
+            waiting.remove(request)
+        if not waiting:
+            # nobody waits for it anymore : a query that did not start is cancelled,
+            # a running one is left to finish and the next identical request starts afresh
+            future.cancel()
+            if self.futures.get(key) is future:
+                del self.futures[key]
+
+        if errback:
+            errback(error)
+
+
+    def poll(self):
+        while True:
+            try:
+                key, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if self.futures.get(key) is future:
+                del self.futures[key]
+            for request in self.waiting.pop(future, []):
+                self.deliver(request, future)
+
+        now = monotonic()
+        for request in [request for request, (*_, deadline) in self.requests.items() if deadline < now]:
+            self.drop(request, QueryTimeout(f"no result after {self.timeout}s"))
+
+
+    def deliver(self, request, future):
+        slot, _, _, callback, errback, _ = self.requests.pop(request)
+        if self.latest.get(slot) == request:
+            del self.latest[slot]
+
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is None:
+            callback(future.result())
+        elif errback:
+            errback(error)
+        else:
+            print("something went wrong...")
+            print(type(error))
+            print(error)
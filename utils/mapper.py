@@ -0,0 +1,87 @@
+from operator import itemgetter
+
+from utils.utils import readJson, nameFields
+
+
+def compile_field(entry):
+    # getter reading the mapped value out of a record
+    if not type(entry) == dict:
+        return itemgetter(entry)
+
+    elif "addition" in entry:
+        if len(entry["addition"]) != 2:
+            raise ValueError(f"bad json structure : addition needs two fields in {entry}")
+        left, right = map(itemgetter, entry["addition"])
+        return lambda fields: left(fields) + right(fields)
+
+    elif "var" in entry and "pos" in entry:
+        var, pos = itemgetter(entry["var"]), itemgetter(entry["pos"])
+        return lambda fields: pos(var(fields))
+
+    raise ValueError(f"bad json structure : no interpretation for {entry}")
+
+
+def compile_fields(mapper, keys):
+    # getters of keys, checked once when the api is loaded rather than at each record
+    missing = [key for key in ["ville"] + keys if key not in mapper]
+    if missing:
+        raise ValueError(f"bad json structure : {missing} missing in {mapper}")
+
+    return [compile_field(mapper[key]) for key in keys]
+
+
+def compile_static(mapper):
+    _id, nom, total, longitude, latitude = compile_fields(mapper, ["_id", "nom", "nbplacestotal", "longitude", "latitude"])
+    town, prefix = mapper["ville"], f"{mapper['ville']}_"
+
+    def transform(fields):
+        name = nom(fields).title()
+        return {
+            "_id": f"{prefix}{_id(fields)}",
+            "ville": town,
+            "nom": name,
+            **nameFields(name),
+            "nbvelosdispo": 0,
+            "nbplacesdispo": 0,
+            "nbplacestotal": total(fields),
+            "actif": True,
+            "version": 0,
+            "geometry": {
+                "type": "Point",
+                "coordinates": [longitude(fields), latitude(fields)]
+            }
+        }
+
+    return transform
+
+
+def compile_dynamic(mapper):
+    _id, velos, places = compile_fields(mapper, ["_id", "nbvelosdispo", "nbplacesdispo"])
+    prefix = f"{mapper['ville']}_"
+
+    def transform(fields):
+        return {
+            "_id": f"{prefix}{_id(fields)}",
+            "nbvelosdispo": velos(fields),
+            "nbplacesdispo": places(fields)
+        }
+
+    return transform
+
+
+COMPILERS = {
+    "static": compile_static,
+    "dynamic": compile_dynamic
+}
+
+
+def load_api(path, section):
+    api = readJson(path)[section]
+
+    try:
+        api["transform"] = COMPILERS[section](api["fields_mapper"])
+    except (KeyError, ValueError) as e:
+        print(f"'{path}' : {e}, close program.")
+        exit(1)
+
+    return api
@@ -1,9 +1,30 @@
 import json
 import os
+import re
+import unicodedata
 import requests
-import io
-import pickle
-from guizero import Box, TextBox, Text
+import ijson
+from itertools import chain, islice
+from requests.adapters import HTTPAdapter
+from time import time
+
+
+HTTP_TIMEOUT = (5, 30) # seconds : connect, read
+POOL_SIZE = 8 # keep-alive connections per host
+CHUNK_SIZE = 64 * 1024 # bytes read at once from a feed
+NGRAM = 3 # characters per indexed piece of station name
+GBFS_HEADER_SIZE = 512 # bytes, gbfs puts last_updated and ttl before data
+STREAM_MIN = 1024 * 1024 # bytes, smaller feeds are parsed at once : ~4x less cpu than streaming them
+
+LAST_UPDATED = re.compile(rb'"last_updated"\s*:\s*(\d+)')
+TTL = re.compile(rb'"ttl"\s*:\s*(\d+)')
+
+session = requests.Session()
+session.headers.update({"Accept-Encoding": "gzip, deflate"})
+session.mount("http://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+session.mount("https://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+
+feeds = {} # url => validators of the last conditional fetch
 
 
 def listFiles(path):
@@ -22,7 +43,119 @@ def readJson(jsonFile):
 
 
 def download(url):
-    return requests.get(url).json()
+    return fetch(url)
+
+
+def fetch(url, conditional=False):
+    body = open_feed(url, conditional)
+    if body is None:
+        return None
+
+    return json.loads(b"".join(body))
+
+
+def stream(url, actions, conditional=False):
+    body = open_feed(url, conditional)
+    if body is None:
+        return None
+
+    return parse_feed(body, actions)
+
+
+def parse_feed(chunks, actions):
+    # records of a feed : json.loads when it ends within STREAM_MIN bytes, streamed above (bounded memory)
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= STREAM_MIN:
+            return stream_data(chain([head], chunks), actions)
+
+    return iter(access_data(json.loads(head), actions))
+
+
+def open_feed(url, conditional=False):
+    # conditional : None when the feed didn't change since the previous conditional fetch of url
+    previous = feeds.get(url, {}) if conditional else {}
+
+    if previous.get("expires", 0) > time():
+        return None
+
+    headers = {}
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+
+    response = session.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True)
+    if response.status_code == 304:
+        response.close()
+        return None
+    response.raise_for_status()
+
+    chunks = response.iter_content(CHUNK_SIZE)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= GBFS_HEADER_SIZE:
+            break
+
+    if conditional:
+        current = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+
+        last_updated = LAST_UPDATED.search(head[:GBFS_HEADER_SIZE])
+        if last_updated:
+            current["last_updated"] = int(last_updated.group(1))
+            ttl = TTL.search(head[:GBFS_HEADER_SIZE])
+            current["expires"] = current["last_updated"] + (int(ttl.group(1)) if ttl else 0)
+
+        feeds[url] = current
+        if previous.get("last_updated") and previous["last_updated"] == current.get("last_updated"):
+            response.close()
+            return None # same gbfs snapshot, skip parsing
+
+    return chain([head], chunks)
+
+
+def stream_prefix(actions):
+    prefix = []
+    for key in actions:
+        if not type(key) == dict:
+            prefix.append(str(key))
+
+        elif "unpack" in key:
+            prefix += ["item", key["unpack"]]
+
+    if not actions or not type(actions[-1]) == dict:
+        prefix.append("item") # records are the items of the accessed list
+
+    return ".".join(prefix)
+
+
+def stream_data(chunks, actions):
+    # same records as access_data(json.loads(b"".join(chunks)), actions), one at a time
+    records = ijson.sendable_list()
+    parser = ijson.items_coro(records, stream_prefix(actions), use_float=True)
+
+    for chunk in chunks:
+        parser.send(chunk)
+        yield from records
+        del records[:]
+
+    parser.close()
+    yield from records
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 def access_data(accessed, actions):
@@ -36,25 +169,20 @@ def access_data(accessed, actions):
     return accessed
 
 
-def formGenerator(container, config):
-    inputsContainer = Box(container, layout="grid")
-
-    i = 0
-    for (key, data) in config.items():
-        Text(inputsContainer, grid=[0,i], text=data["text"].title())
-        Text(inputsContainer, grid=[1,i])  # margin
-        config[key]["ptr"] = TextBox(inputsContainer, grid=[2,i], width="25")
+def normalize(text):
+    # lowercase, no accent, single spaces : "Comédie  Sud" => "comedie sud"
+    text = unicodedata.normalize("NFKD", str(text))
+    return " ".join("".join(char for char in text if not unicodedata.combining(char)).lower().split())
 
-        if "value" in data:
-            config[key]["ptr"].value = data["value"]
-        i += 1
 
-        Box(inputsContainer, grid=[0,i], height="5")  # margin
-        i += 1
+def ngrams(text, size=NGRAM):
+    return sorted({text[i:i+size] for i in range(len(text) - size + 1)})
 
 
-def dumpGraph(graph):
-    graph_buffer = io.BytesIO()
-    pickle.dump(graph, graph_buffer)
-    graph_buffer.seek(0)  # crucial
-    return pickle.load(graph_buffer)
+def nameFields(name):
+    # search fields stored next to "nom", see exo4_1.searchByTownAndStation
+    normalized = normalize(name)
+    return {
+        "nom_normalise": normalized,
+        "nom_ngrams": ngrams(normalized)
+    }